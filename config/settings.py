@@ -21,6 +21,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'main.apps.MainConfig',
     'rest_framework',
     'rest_framework.authtoken',
@@ -105,7 +106,27 @@ REDIS_HOST = os.environ.get('REDIS_HOST')
 REDIS_PORT = os.environ.get('REDIS_PORT')
 
 CELERY_BROKER_URL = f'redis://{REDIS_HOST}:{REDIS_PORT}/0'
-result_backend = f'redis://{REDIS_HOST}:{REDIS_PORT}/0'
+CELERY_RESULT_BACKEND = f'redis://{REDIS_HOST}:{REDIS_PORT}/0'
+CELERY_BEAT_SCHEDULE = {
+    'cleanup-upload-sessions': {
+        'task': 'main.tasks.cleanup_upload_sessions',
+        'schedule': 60 * 60,
+    },
+}
+
+# Срок (в секундах) без новых частей, после которого незавершённая загрузка частями
+# удаляется вместе с файлом
+UPLOAD_SESSION_MAX_AGE = int(os.environ.get('UPLOAD_SESSION_MAX_AGE', 24 * 60 * 60))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f'redis://{REDIS_HOST}:{REDIS_PORT}/1',
+    }
+}
+
+# Списки каталога собираются из values() без полей DRF (main.fast)
+FAST_SERIALIZATION = os.environ.get('FAST_SERIALIZATION', '1') == '1'
 
 
 REST_FRAMEWORK = {
@@ -120,6 +141,7 @@ REST_FRAMEWORK = {
     'DEFAULT_THROTTLE_RATES': {
         'users': '10/minute',
         'upload': '2/minute',
+        'upload_chunks': '600/minute',
         'password_reset': '1/minute'
     }
 }
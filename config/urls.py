@@ -4,10 +4,14 @@ from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, Sp
 from rest_framework import routers
 
 from users.views import UserViewSet, UserLoginView, PasswordResetViewSet
-from main.views import PricelistUploadViewSet, ProductViewSet, OrderViewSet, CartViewSet
+from main.views import (
+    PricelistUploadViewSet, PricelistUploadSessionViewSet, ProductViewSet, OrderViewSet,
+    CartViewSet
+)
 
 router = routers.SimpleRouter()
 router.register(r'upload', PricelistUploadViewSet, 'upload')
+router.register(r'upload-sessions', PricelistUploadSessionViewSet, 'upload-sessions')
 router.register(r'products', ProductViewSet, 'products')
 router.register(r'orders', OrderViewSet, 'orders')
 router.register(r'cart', CartViewSet, 'cart')
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import time
+import uuid
+
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+# Время хранения ответа каталога - верхняя граница устаревания, если
+# инвалидация не дошла (например, цены изменены не через импорт)
+CATALOG_CACHE_TIMEOUT = 60 * 5
+STATS_FIELDS = ['hits', 'misses', 'not_modified', 'invalidations']
+
+
+def _incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def _generation():
+    return cache.get_or_set('catalog:generation', 0, None)
+
+
+def list_key(request):
+    """
+    Ключ страницы списка: поколение каталога и полный адрес запроса
+    (в ответе есть абсолютные ссылки на соседние страницы).
+    """
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'catalog:list:{_generation()}:{url}'
+
+
+def _version_key(variant_id):
+    return f'catalog:variant:{variant_id}:version'
+
+
+def detail_key(variant_id, fields):
+    """
+    Ключ карточки модификации: версия модификации и набор полей ответа
+    (?fields=, ?expand=). Инвалидация меняет версию - все наборы полей
+    модификации устаревают сразу, старые ключи истекают сами.
+    """
+    version = cache.get_or_set(_version_key(variant_id), lambda: uuid.uuid4().hex, None)
+    fields = hashlib.md5(','.join(fields).encode()).hexdigest()
+    return f'catalog:variant:{variant_id}:{version}:{fields}'
+
+
+def cached_response(request, key, build):
+    """
+    Ответ каталога из кэша с поддержкой If-None-Match.
+
+    `build` строит ответ при промахе. Кэшируются только успешные ответы
+    (сериализованные данные, ETag и время сохранения). Заголовок X-Cache
+    показывает попадание, Age - возраст ответа в секундах.
+    """
+    entry = cache.get(key)
+    if entry is None:
+        _incr('catalog:stats:misses')
+        response = build()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        etag = hashlib.md5(
+            json.dumps(response.data, sort_keys=True, default=str).encode()).hexdigest()
+        entry = {'data': response.data, 'etag': f'"{etag}"', 'cached_at': time.time()}
+        cache.set(key, entry, CATALOG_CACHE_TIMEOUT)
+        cache_status = 'MISS'
+    else:
+        _incr('catalog:stats:hits')
+        cache_status = 'HIT'
+    if request.headers.get('If-None-Match') == entry['etag']:
+        _incr('catalog:stats:not_modified')
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(entry['data'])
+    response['ETag'] = entry['etag']
+    response['X-Cache'] = cache_status
+    response['Age'] = str(int(time.time() - entry['cached_at']))
+    return response
+
+
+def invalidate(variant_ids):
+    """
+    Инвалидация после изменения цен модификаций `variant_ids`.
+
+    У карточек меняется версия модификации. Страница списка может содержать любую
+    модификацию, поэтому страницы списков сбрасываются сменой поколения
+    каталога - старые ключи истекают сами.
+    """
+    if not variant_ids:
+        return
+    cache.set_many(
+        {_version_key(variant_id): uuid.uuid4().hex for variant_id in variant_ids}, None)
+    _generation()
+    cache.incr('catalog:generation')
+    _incr('catalog:stats:invalidations')
+
+
+def get_stats():
+    """Счётчики кэша каталога и доля попаданий"""
+    data = cache.get_many([f'catalog:stats:{field}' for field in STATS_FIELDS])
+    stats = {field: data.get(f'catalog:stats:{field}', 0) for field in STATS_FIELDS}
+    requests = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / requests, 3) if requests else None
+    return stats
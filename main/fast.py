@@ -0,0 +1,110 @@
+from collections import defaultdict
+from functools import lru_cache
+
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class ValuesSerializer:
+    """
+    Быстрая сериализация списков по описанию полей сериализатора DRF.
+
+    Поля сериализатора разбираются один раз: `source` поля превращается в путь
+    для `values()`, от поля остаётся только его `to_representation`. Записи
+    читаются через `values()` и собираются в словари без обхода атрибутов
+    моделей и без вызова `Serializer.to_representation` на каждую запись,
+    при этом результат совпадает с результатом сериализатора.
+
+    Поддерживаются поля-значения и вложенные сериализаторы many=True по обратному
+    внешнему ключу (например, цены модификации) - они читаются одним запросом
+    на страницу в порядке id. `field_names` - выбранные поля сериализатора
+    (по умолчанию все).
+    """
+
+    def __init__(self, serializer, field_names=None):
+        self.model = serializer.Meta.model
+        # (имя в ответе, путь в values(), to_representation, вложенный сериализатор)
+        self.fields = []
+        for name, field in serializer.fields.items():
+            if field_names is not None and name not in field_names:
+                continue
+            if isinstance(field, serializers.ListSerializer):
+                relation = self.model._meta.get_field(field.source)
+                child = ValuesSerializer(field.child)
+                child.parent_path = relation.field.attname
+                self.fields.append((name, field.source, None, child))
+            elif field.source == '*' or isinstance(field, serializers.RelatedField):
+                raise ValueError(f'Field `{name}` cannot be read with values()')
+            else:
+                path = '__'.join(field.source_attrs)
+                self.fields.append((name, path, field.to_representation, None))
+        self.paths = ['pk'] + [path for _, path, _, child in self.fields if child is None]
+
+    def values(self, queryset, *extra_paths):
+        """
+        Записи для `serialize`: queryset со всеми фильтрами и сортировкой.
+        `extra_paths` - поля, нужные помимо полей ответа (например, для пагинации).
+        """
+        return queryset.prefetch_related(None).values(*self.paths, *extra_paths)
+
+    def serialize(self, rows):
+        nested = {
+            name: child.serialize_related([row['pk'] for row in rows])
+            for name, _, _, child in self.fields if child is not None
+        }
+        data = []
+        for row in rows:
+            item = {}
+            for name, path, to_representation, child in self.fields:
+                if child is not None:
+                    item[name] = nested[name].get(row['pk'], [])
+                else:
+                    value = row[path]
+                    item[name] = None if value is None else to_representation(value)
+            data.append(item)
+        return data
+
+    def serialize_related(self, parent_ids):
+        """Вложенные записи, сгруппированные по id родителя: {id: [запись, ...]}"""
+        rows = list(self.model.objects.filter(
+            **{f'{self.parent_path}__in': parent_ids}
+        ).order_by('pk').values(self.parent_path, *self.paths))
+        grouped = defaultdict(list)
+        for row, item in zip(rows, self.serialize(rows)):
+            grouped[row[self.parent_path]].append(item)
+        return grouped
+
+
+@lru_cache(maxsize=None)
+def get_values_serializer(serializer_class, field_names=None):
+    return ValuesSerializer(serializer_class(), field_names)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSON через orjson с тем же выводом, что у JSONRenderer: компактный,
+    без экранирования не-ASCII символов, даты - в формате кодировщика DRF.
+
+    Без orjson, с отступами (?indent) и для значений, которые orjson
+    не сериализует, используется JSONRenderer. Отличается только запись
+    чисел с плавающей точкой в экспоненциальной форме (1e16 вместо 1e+16).
+    """
+    fast_options = orjson and (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or not self.compact or self.ensure_ascii or \
+                self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data, default=encoders.JSONEncoder().default, option=self.fast_options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Как в JSONRenderer: разделители строк JavaScript экранируются
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
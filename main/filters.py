@@ -0,0 +1,136 @@
+from datetime import datetime, time
+
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from main.importer import normalize
+from main.models import Order, Pricelist, Variant
+
+# Допустимые значения параметра ordering каталога
+PRODUCT_ORDERINGS = [
+    'id', '-id', 'sku', '-sku',
+    'min_price', '-min_price', 'min_landed_price', '-min_landed_price',
+]
+# Сортировки по сводке предложений: модификации без предложений в наличии не выводятся
+PRICE_ORDERINGS = ['min_price', 'min_landed_price']
+
+
+def get_int_param(params, name):
+    value = params.get(name, '')
+    if value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError({name: 'must be an integer'})
+
+
+def get_datetime_param(params, name):
+    """Дата или дата и время в формате ISO 8601; дата - начало дня в текущем часовом поясе"""
+    value = params.get(name, '')
+    if value == '':
+        return None
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            date = parse_date(value)
+            parsed = date and datetime.combine(date, time.min)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: 'must be an ISO 8601 date or datetime'})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def get_product_ordering(params):
+    """
+    Сортировка каталога из параметра ordering: поле и id в том же направлении.
+
+    id нужен для однозначного порядка модификаций с одинаковой ценой -
+    сортировка совпадает с индексами (min_price, id) и (min_landed_price, id).
+    """
+    ordering = params.get('ordering') or PRODUCT_ORDERINGS[0]
+    if ordering not in PRODUCT_ORDERINGS:
+        raise ValidationError({'ordering': f'must be one of {PRODUCT_ORDERINGS}'})
+    if ordering.lstrip('-') in ('id', 'sku'):
+        return (ordering,)
+    return ordering, '-id' if ordering.startswith('-') else 'id'
+
+
+def order_products(queryset, ordering):
+    """Сортировка каталога результатом `get_product_ordering`"""
+    field = ordering[0].lstrip('-')
+    if field in PRICE_ORDERINGS:
+        queryset = queryset.filter(**{f'{field}__isnull': False})
+    return queryset.order_by(*ordering)
+
+
+def filter_products(queryset, params):
+    """
+    Фильтрация каталога по параметрам запроса.
+
+    Условия на цену, наличие и продавца проверяются одним EXISTS по предложениям
+    (Pricelist) - они должны выполняться для одного и того же предложения.
+    Каждая характеристика проверяется отдельным EXISTS по таблице связей
+    `Variant.props`, поэтому совпасть должны все указанные характеристики.
+    """
+    categories = [normalize(title) for title in params.getlist('category')]
+    if categories:
+        queryset = queryset.filter(product__category__title__in=categories)
+    brands = [normalize(title) for title in params.getlist('brand')]
+    if brands:
+        queryset = queryset.filter(product__brand__title__in=brands)
+
+    offer_filters = {}
+    seller = get_int_param(params, 'seller')
+    if seller is not None:
+        offer_filters['seller_id'] = seller
+    min_price = get_int_param(params, 'min_price')
+    if min_price is not None:
+        offer_filters['product_price__gte'] = min_price
+    max_price = get_int_param(params, 'max_price')
+    if max_price is not None:
+        offer_filters['product_price__lte'] = max_price
+    if params.get('in_stock', '').lower() in ('1', 'true'):
+        offer_filters['in_stock__gt'] = 0
+    if offer_filters:
+        queryset = queryset.filter(Exists(
+            Pricelist.objects.filter(variant_id=OuterRef('pk'), **offer_filters)))
+
+    for prop in params.getlist('prop'):
+        title, separator, value = prop.partition(':')
+        if not separator:
+            raise ValidationError({'prop': 'expected `title:value`'})
+        queryset = queryset.filter(Exists(Variant.props.through.objects.filter(
+            variant_id=OuterRef('pk'),
+            property__title=normalize(title),
+            property__value=normalize(value))))
+    return queryset
+
+
+# Статусы оформленных заказов (корзина в список заказов не входит)
+ORDER_STATUSES = [status for status, _ in Order.STATUSES if status != 'in_cart']
+
+
+def filter_orders(queryset, params):
+    """
+    Фильтрация заказов по статусу (можно указать несколько) и дате оформления:
+    created_after - не раньше, created_before - раньше указанного момента.
+    """
+    statuses = params.getlist('status')
+    if statuses:
+        unknown = set(statuses) - set(ORDER_STATUSES)
+        if unknown:
+            raise ValidationError({'status': f'must be one of {ORDER_STATUSES}'})
+        queryset = queryset.filter(status__in=statuses)
+    created_after = get_datetime_param(params, 'created_after')
+    if created_after is not None:
+        queryset = queryset.filter(created_at__gte=created_after)
+    created_before = get_datetime_param(params, 'created_before')
+    if created_before is not None:
+        queryset = queryset.filter(created_at__lt=created_before)
+    return queryset
@@ -0,0 +1,797 @@
+import codecs
+import csv
+import gzip
+import hashlib
+import json
+from collections import OrderedDict
+from itertools import islice
+from operator import itemgetter
+from typing import NamedTuple
+
+from django.db import connection, transaction
+
+from main.models import Category, Brand, Product, Variant, Pricelist, Property
+from main.offers import update_offer_summary
+from main.search import update_search_vectors
+
+# Количество строк прайс-листа, обрабатываемых за один проход
+CHUNK_SIZE = 1000
+# Количество строк прайс-листа, импортируемых одной задачей Celery
+SHARD_SIZE = 20000
+# Максимальное количество ошибок проверки, сохраняемых в результате выгрузки
+MAX_ERRORS = 1000
+# Максимальное количество записей каждого справочника в кэше импорта
+DIMENSION_CACHE_SIZE = 10000
+# Верхняя граница значений целочисленных полей (in_stock - SmallIntegerField)
+INT_FIELD_MAX = {4: 32767, 5: 2147483647, 6: 2147483647}
+
+# Поддерживаемые форматы прайс-листа: суффикс имени файла -> формат
+FILE_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.parquet': 'parquet'}
+GZIP_MAGIC = b'\x1f\x8b'
+BOM = codecs.BOM_UTF8
+PARQUET_MAGIC = b'PAR1'
+# Поля записи прайс-листа в JSON Lines и Parquet в порядке столбцов CSV
+ROW_FIELDS = [
+    'category', 'brand', 'model', 'sku', 'in_stock', 'product_price', 'delivery_price'
+]
+
+# Маппинг столбцов по типу данных (кроме характеристик)
+INDEX_TYPE_MAP = {
+    0: [str, 'category title'],
+    1: [str, 'brand name'],
+    2: [str, 'product model'],
+    3: [str, 'product sku'],
+    4: [int, 'in_stock'],
+    5: [int, 'price'],
+    6: [int, 'delivery price']
+}
+
+
+# Максимальная длина строковых полей (по столбцам) и характеристик - по полям моделей
+STR_FIELD_MAX_LENGTH = {
+    0: Category._meta.get_field('title').max_length,
+    1: Brand._meta.get_field('title').max_length,
+    2: Product._meta.get_field('title').max_length,
+    3: Variant._meta.get_field('sku').max_length,
+}
+PROP_MAX_LENGTH = {
+    'title': Property._meta.get_field('title').max_length,
+    'value': Property._meta.get_field('value').max_length,
+}
+
+# Поля цены продавца, заполняемые из прайс-листа
+PRICE_FIELDS = ['in_stock', 'product_price', 'delivery_price']
+
+# Артикулы проверяемого файла во временной таблице: повторы ищутся запросом,
+# без множества всех артикулов файла в памяти
+CREATE_SKU_TABLE_SQL = 'CREATE TEMPORARY TABLE IF NOT EXISTS pricelist_sku (line integer, sku text)'
+INSERT_SKUS_SQL = '''
+INSERT INTO pricelist_sku (line, sku) SELECT * FROM unnest(%s::integer[], %s::text[])
+'''
+DUPLICATE_SKUS_SQL = '''
+SELECT line, sku, first_line FROM (
+    SELECT line, sku, min(line) OVER (PARTITION BY sku) AS first_line FROM pricelist_sku
+) AS skus
+WHERE line > first_line
+ORDER BY line
+LIMIT %s
+'''
+COUNT_DUPLICATE_SKUS_SQL = 'SELECT count(*) - count(DISTINCT sku) FROM pricelist_sku'
+# Отметка неизменившихся строк выгрузкой. Строки блокируются в порядке
+# (variant_id, id), как при записи цен и оформлении заказа
+MARK_IMPORTED_SQL = '''
+UPDATE main_pricelist SET import_id = %s
+WHERE id IN (
+    SELECT id FROM main_pricelist WHERE id = ANY(%s) ORDER BY variant_id, id FOR UPDATE
+)
+'''
+# Снятие с продажи строк продавца, не отмеченных выгрузкой. Уже снятые строки
+# (нулевой остаток без отпечатка) пропускаются; отпечаток без остатка сбрасывает
+# и оформление заказа (offers.RESERVE_STOCK_SQL)
+REMOVE_MISSING_SQL = '''
+UPDATE main_pricelist SET in_stock = 0, row_hash = ''
+WHERE id IN (
+    SELECT id FROM main_pricelist
+    WHERE seller_id = %s AND (row_hash <> '' OR in_stock > 0)
+        AND import_id IS DISTINCT FROM %s
+    ORDER BY variant_id, id
+    FOR UPDATE
+)
+RETURNING variant_id
+'''
+
+
+class PricelistRow(NamedTuple):
+    category: str
+    brand: str
+    model: str
+    sku: str
+    in_stock: int
+    product_price: int
+    delivery_price: int
+    props: tuple
+
+
+class ValidationResult(NamedTuple):
+    errors: list
+    errors_total: int
+    rows_total: int
+    # Позиции первых строк диапазонов split_shards (см. iter_rows)
+    shard_starts: list
+
+
+def validate_upload_format(line_number, items):
+    # Строка, которую не удалось декодировать из UTF-8 (см. TextLines)
+    if items is None:
+        return {'line': line_number, 'detail': 'line is not valid UTF-8 text'}
+
+    # Обязательных столбцов 7, если кол-во "столбцов" чётное - значит не заполнены
+    # какие-то поля характеристик
+    if len(items) < 7 or len(items) % 2 == 0:
+        return {
+            'line': line_number,
+            'detail': 'wrong column count (not enough `characteristic-value` pairs)'
+        }
+
+    for ix, item in enumerate(items[:7]):
+        item_type = INDEX_TYPE_MAP[ix][0]
+        item_field = INDEX_TYPE_MAP[ix][1]
+
+        # Строковые поля могут состоять из цифр (модель "3310", артикул "12345"),
+        # проверяем, что они заполнены и помещаются в поле модели
+        if item_type is str:
+            if not item.strip():
+                return {
+                    'line': line_number,
+                    'value': item,
+                    'detail': f'Field `{item_field}` (index {ix}) cannot be blank'
+                }
+            # Значения записываются как в parse_row: артикул без изменения регистра
+            value = item.strip() if ix == 3 else normalize(item)
+            if len(value) > STR_FIELD_MAX_LENGTH[ix]:
+                return {
+                    'line': line_number,
+                    'value': item,
+                    'detail': f'Field `{item_field}` (index {ix}) must be at most '
+                              f'{STR_FIELD_MAX_LENGTH[ix]} characters'
+                }
+            continue
+
+        try:
+            item_value = int(item)
+        except ValueError:
+            return {
+                'line': line_number,
+                'value': item,
+                'detail': f'Field `{item_field}` (index {ix}) must be of type {item_type}'
+            }
+        if not 0 <= item_value <= INT_FIELD_MAX[ix]:
+            return {
+                'line': line_number,
+                'value': item,
+                'detail': f'Field `{item_field}` (index {ix}) must be between 0 '
+                          f'and {INT_FIELD_MAX[ix]}'
+            }
+
+    for ix in range(7, len(items)):
+        part = 'title' if ix % 2 else 'value'
+        if len(normalize(items[ix])) > PROP_MAX_LENGTH[part]:
+            return {
+                'line': line_number,
+                'value': items[ix],
+                'detail': f'Characteristic {part} (index {ix}) must be at most '
+                          f'{PROP_MAX_LENGTH[part]} characters'
+            }
+    return None
+
+
+def validate_pricelist(field_file, on_progress=None):
+    """
+    Проверка всего файла до начала импорта: количество столбцов, целочисленные поля
+    и повторы артикулов. Попутно запоминаются позиции начала диапазонов строк
+    для параллельного импорта.
+
+    Артикулы записываются во временную таблицу, повторы ищутся одним запросом
+    после чтения файла - память не растёт с размером файла.
+
+    Файл читается потоково, в результат попадают первые `MAX_ERRORS` ошибок
+    (с номерами строк) и общее их количество. `on_progress` вызывается
+    с количеством проверенных строк раз в `CHUNK_SIZE` строк.
+    """
+    errors = []
+    errors_total = 0
+    rows_total = 0
+    shard_starts = []
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_SKU_TABLE_SQL)
+        cursor.execute('TRUNCATE pricelist_sku')
+        try:
+            skus = []
+            for line_number, items, resume in iter_rows(field_file):
+                if rows_total % SHARD_SIZE == 0:
+                    shard_starts.append(resume)
+                rows_total += 1
+                if on_progress and rows_total % CHUNK_SIZE == 0:
+                    on_progress(CHUNK_SIZE)
+                error = validate_upload_format(line_number, items)
+                if error is None:
+                    skus.append((line_number, items[3].strip()))
+                    if len(skus) == CHUNK_SIZE:
+                        cursor.execute(INSERT_SKUS_SQL, [list(column) for column in zip(*skus)])
+                        skus = []
+                    continue
+                errors_total += 1
+                if len(errors) < MAX_ERRORS:
+                    errors.append(error)
+            if skus:
+                cursor.execute(INSERT_SKUS_SQL, [list(column) for column in zip(*skus)])
+            cursor.execute(DUPLICATE_SKUS_SQL, [MAX_ERRORS])
+            duplicates = [
+                {
+                    'line': line,
+                    'value': sku,
+                    'detail': f'Duplicate product sku (first occurrence on line {first_line})'
+                }
+                for line, sku, first_line in cursor.fetchall()
+            ]
+            cursor.execute(COUNT_DUPLICATE_SKUS_SQL)
+            errors_total += cursor.fetchone()[0]
+        finally:
+            cursor.execute('DROP TABLE pricelist_sku')
+    if on_progress and rows_total % CHUNK_SIZE:
+        on_progress(rows_total % CHUNK_SIZE)
+    errors = sorted(errors + duplicates, key=itemgetter('line'))[:MAX_ERRORS]
+    return ValidationResult(errors, errors_total, rows_total, shard_starts)
+
+
+def normalize(value):
+    return value.lower().strip()
+
+
+def parse_row(items):
+    props = tuple(
+        (normalize(items[ind]), normalize(items[ind + 1])) for ind in range(7, len(items), 2)
+    )
+    return PricelistRow(
+        category=normalize(items[0]),
+        brand=normalize(items[1]),
+        model=normalize(items[2]),
+        sku=items[3].strip(),
+        in_stock=int(items[4]),
+        product_price=int(items[5]),
+        delivery_price=int(items[6]),
+        props=props,
+    )
+
+
+def fingerprint(row):
+    """Отпечаток нормализованной строки прайс-листа (порядок характеристик не важен)"""
+    data = json.dumps([*row[:7], sorted(row.props)], ensure_ascii=False)
+    return hashlib.md5(data.encode()).hexdigest()
+
+
+def iter_chunks(iterable, size=CHUNK_SIZE):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def detect_format(file_name):
+    """
+    Формат прайс-листа по имени файла ('csv', 'jsonl' или 'parquet'),
+    суффикс .gz (сжатие gzip) не учитывается. Для неизвестных форматов - None.
+    """
+    name = file_name.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    for suffix, file_format in FILE_FORMATS.items():
+        if name.endswith(suffix):
+            return file_format
+    return None
+
+
+def parquet_available():
+    """Чтение Parquet требует необязательной зависимости pyarrow"""
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def read_rows(field_file, resume=None):
+    """
+    Потоковое чтение строк прайс-листа из хранилища.
+
+    Поддерживаются CSV и JSON Lines (в том числе сжатые gzip) и Parquet,
+    формат определяется по содержимому файла. Файл читается по мере итерации:
+    текстовые форматы - по строке, Parquet - пакетами по `CHUNK_SIZE` строк.
+    Возвращает пары (номер строки без учёта заголовка, список столбцов в порядке CSV),
+    для строк не в UTF-8 вместо списка столбцов - None.
+
+    `resume` - позиция строки из `iter_rows`: чтение начинается с этой строки.
+    """
+    for line_number, items, _ in iter_rows(field_file, resume):
+        yield line_number, items
+
+
+def iter_rows(field_file, resume=None):
+    """
+    Строки прайс-листа, как в `read_rows`, с позицией каждой строки -
+    парой (смещение, номер предыдущей строки). Смещение - номер байта начала
+    строки (для gzip - в распакованных данных) в текстовых форматах и номер
+    записи в Parquet. С позиции чтение продолжается без разбора предыдущих строк.
+    """
+    offset, line_number = resume or (0, 0)
+    with field_file.open('rb') as raw:
+        magic = raw.read(len(PARQUET_MAGIC))
+        raw.seek(0)
+        if magic == PARQUET_MAGIC:
+            yield from _read_parquet(raw, offset)
+            return
+        stream = gzip.GzipFile(fileobj=raw) if magic.startswith(GZIP_MAGIC) else raw
+        # Формат - по первой строке файла, затем переход к позиции
+        is_jsonl = stream.readline().removeprefix(BOM).lstrip().startswith(b'{')
+        stream.seek(offset)
+        lines = TextLines(stream, offset)
+        if is_jsonl:
+            yield from _read_jsonl(lines, line_number)
+        else:
+            yield from _read_csv(lines, line_number)
+
+
+class TextLines:
+    """
+    Строки бинарного потока, декодированные из UTF-8, со смещением (`position`)
+    начала следующей непрочитанной строки. Строки не в UTF-8 (например, cp1251)
+    декодируются с заменой символов и учитываются в `decode_errors`.
+    """
+
+    def __init__(self, stream, position=0):
+        self.stream = stream
+        self.position = position
+        self.decode_errors = 0
+
+    def __iter__(self):
+        # Итерация по django File читает файл с начала, поэтому - readline
+        for line in iter(self.stream.readline, b''):
+            self.position += len(line)
+            if self.position == len(line):
+                line = line.removeprefix(BOM)
+            try:
+                yield line.decode('utf-8')
+            except UnicodeDecodeError:
+                self.decode_errors += 1
+                yield line.decode('utf-8', 'replace')
+
+
+def _read_csv(lines, line_number):
+    reader = csv.reader(lines)
+    if lines.position == 0:
+        # Пропускаем строку заголовков
+        next(reader, None)
+    # csv.reader читает строки по одной на запись, поэтому после записи
+    # смещение указывает на начало следующей
+    position = lines.position
+    decode_errors = lines.decode_errors
+    for items in reader:
+        line_number += 1
+        # Пустые строки (например, перевод строки в конце файла) не импортируем
+        if items:
+            # Запись не в UTF-8 отклоняется проверкой (validate_upload_format)
+            if lines.decode_errors != decode_errors:
+                items = None
+            yield line_number, items, (position, line_number - 1)
+        position = lines.position
+        decode_errors = lines.decode_errors
+
+
+def _row_items(obj):
+    """Столбцы строки в порядке CSV из записи {поле: значение, 'props': {название: значение}}"""
+    items = ['' if obj.get(field) is None else str(obj[field]) for field in ROW_FIELDS]
+    for title, value in (obj.get('props') or {}).items():
+        items += [str(title), '' if value is None else str(value)]
+    return items
+
+
+def _read_jsonl(lines, line_number):
+    position = lines.position
+    decode_errors = lines.decode_errors
+    for line in lines:
+        line_number += 1
+        resume = (position, line_number - 1)
+        position = lines.position
+        line = line.strip()
+        if lines.decode_errors != decode_errors:
+            decode_errors = lines.decode_errors
+            yield line_number, None, resume
+            continue
+        if not line:
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError:
+            obj = None
+        if not isinstance(obj, dict):
+            # Некорректная строка будет отклонена проверкой количества столбцов
+            yield line_number, [line], resume
+            continue
+        yield line_number, _row_items(obj), resume
+
+
+def _read_parquet(raw, start=0):
+    """
+    Чтение Parquet пакетами: столбцы пакета целиком приводятся к строкам средствами
+    pyarrow, столбцы сверх обязательных считаются характеристиками (название столбца -
+    название характеристики, пустые значения пропускаются).
+
+    Пакеты до записи `start` пропускаются без преобразования.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(raw)
+    line_number = 0
+    for batch in parquet_file.iter_batches(batch_size=CHUNK_SIZE):
+        if line_number + batch.num_rows <= start:
+            line_number += batch.num_rows
+            continue
+        columns = {
+            name: pc.cast(column, pa.string()).to_pylist()
+            for name, column in zip(batch.schema.names, batch.columns)
+        }
+        empty = [None] * batch.num_rows
+        required = [columns.get(field, empty) for field in ROW_FIELDS]
+        props = [(name, values) for name, values in columns.items() if name not in ROW_FIELDS]
+        for ix in range(batch.num_rows):
+            line_number += 1
+            if line_number <= start:
+                continue
+            items = ['' if values[ix] is None else values[ix] for values in required]
+            for name, values in props:
+                if values[ix] is not None:
+                    items += [name, values[ix]]
+            yield line_number, items, (line_number - 1, line_number - 1)
+
+
+def read_pricelist(field_file, chunk_size=CHUNK_SIZE, start=0, stop=None, resume=None):
+    """
+    Чтение строк прайс-листа с `start` по `stop` порциями по `chunk_size` строк.
+
+    `resume` - позиция строки `start` (ValidationResult.shard_starts): чтение
+    начинается с неё, предыдущие строки файла не разбираются.
+    """
+    if resume is None:
+        rows = islice(read_rows(field_file), start, stop)
+    else:
+        rows = islice(read_rows(field_file, resume), None if stop is None else stop - start)
+    return iter_chunks(rows, chunk_size)
+
+
+def split_shards(rows_total, shard_size=SHARD_SIZE):
+    """Разбиение прайс-листа на диапазоны строк [start, stop) для параллельного импорта"""
+    return [
+        (start, min(start + shard_size, rows_total))
+        for start in range(0, rows_total, shard_size)
+    ]
+
+
+class DimensionCache:
+    """
+    Ограниченный LRU-кэш "нормализованный ключ -> id" записей справочника.
+
+    Ключ - title для категорий и брендов, (category_id, brand_id, title)
+    для товаров, (title, value) для характеристик.
+    """
+
+    def __init__(self, maxsize=DIMENSION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, keys):
+        """Поиск ключей в кэше: ({ключ: id} найденных, множество отсутствующих ключей)"""
+        found = {}
+        missing = set()
+        for key in keys:
+            pk = self.data.get(key)
+            if pk is None:
+                missing.add(key)
+            else:
+                self.data.move_to_end(key)
+                found[key] = pk
+        self.hits += len(found)
+        self.misses += len(missing)
+        return found, missing
+
+    def update(self, items):
+        """Добавление записей {ключ: id} с вытеснением давно не использованных"""
+        for key, pk in items.items():
+            self.data[key] = pk
+            self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+
+class PricelistImporter:
+    """
+    Пакетный импорт прайс-листа продавца.
+
+    Строки обрабатываются порциями: на каждую порцию приходится по одному
+    запросу на поиск каждого типа сущностей (категории, бренды, товары,
+    модификации, цены, характеристики) и по одному bulk-запросу на запись,
+    независимо от количества строк в порции.
+
+    Несколько импортёров могут работать параллельно (по одному на диапазон
+    строк файла): справочники создаются через INSERT ... ON CONFLICT DO NOTHING
+    по уникальным ключам, а записи вставляются в отсортированном порядке,
+    чтобы конкурирующие транзакции брали блокировки в одной последовательности.
+
+    Повторяющиеся в строках справочники (категории, бренды, товары, характеристики)
+    ищутся сначала в LRU-кэше импортёра, в базу уходят только промахи.
+    """
+
+    def __init__(self, seller, replace_props=False, import_id=None):
+        self.seller = seller
+        # Заменять набор характеристик модификации из прайс-листа, а не дополнять
+        self.replace_props = replace_props
+        # id выгрузки: им отмечаются цены из файла, включая неизменившиеся (remove_missing)
+        self.import_id = import_id
+        self.rows_imported = 0
+        # Счётчики изменений: новые, изменённые, неизменившиеся и снятые с продажи строки
+        self.stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'removed': 0}
+        # id модификаций, цены которых изменены импортёром (для инвалидации кэша каталога)
+        self.changed_variants = set()
+        self.caches = {
+            model.__name__: DimensionCache() for model in (Category, Brand, Product, Property)
+        }
+
+    @property
+    def result(self):
+        """Счётчики изменений и попаданий/промахов кэша справочников"""
+        return {
+            **self.stats,
+            'cache_hits': sum(cache.hits for cache in self.caches.values()),
+            'cache_misses': sum(cache.misses for cache in self.caches.values()),
+        }
+
+    def warm_up(self):
+        """Предзагрузка кэша справочников из базы перед импортом"""
+        for model in (Category, Brand):
+            cache = self.caches[model.__name__]
+            cache.update(dict(model.objects.values_list('title', 'id')[:cache.maxsize]))
+        cache = self.caches['Product']
+        cache.update({
+            (category_id, brand_id, title): pk
+            for category_id, brand_id, title, pk in Product.objects.values_list(
+                'category_id', 'brand_id', 'title', 'id')[:cache.maxsize]
+        })
+        cache = self.caches['Property']
+        cache.update({
+            (title, value): pk
+            for title, value, pk in Property.objects.values_list(
+                'title', 'value', 'id')[:cache.maxsize]
+        })
+
+    def import_chunk(self, lines):
+        """
+        Импорт порции строк вида (номер строки, список столбцов) в одной транзакции.
+
+        Строки должны быть предварительно проверены `validate_pricelist`.
+        """
+        rows = [parse_row(items) for _, items in lines]
+        with transaction.atomic():
+            self._import_rows(rows)
+        self.rows_imported += len(rows)
+
+    def remove_missing(self):
+        """
+        Снятие с продажи цен продавца, которых нет в полностью импортированной
+        выгрузке `import_id` - не отмеченных ею при импорте.
+
+        Строки не удаляются (на них ссылаются позиции заказов), а обнуляются
+        по остатку и теряют отпечаток, чтобы при повторном появлении в прайс-листе
+        записаться заново. Сравнение с выгрузкой выполняется одним UPDATE в базе.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(REMOVE_MISSING_SQL, [self.seller.id, self.import_id])
+            removed_variants = sorted({variant_id for variant_id, in cursor.fetchall()})
+        for chunk in iter_chunks(removed_variants):
+            update_offer_summary(chunk)
+        self.changed_variants.update(removed_variants)
+        self.stats['removed'] += len(removed_variants)
+
+    def _import_rows(self, rows):
+        # При повторе артикула в порции действует последняя строка
+        rows, hashes = self._changed_rows({row.sku: row for row in rows})
+        if not rows:
+            return
+        categories = self._resolve_titled(Category, {row.category for row in rows.values()})
+        brands = self._resolve_titled(Brand, {row.brand for row in rows.values()})
+        product_keys = {
+            sku: (categories[row.category], brands[row.brand], row.model)
+            for sku, row in rows.items()
+        }
+        products = self._resolve_products(set(product_keys.values()))
+        variants = self._resolve_variants({
+            sku: products[key] for sku, key in product_keys.items()
+        })
+        self._save_prices(rows, hashes, variants)
+        update_offer_summary(set(variants.values()))
+        self.changed_variants.update(variants.values())
+        props = self._resolve_properties({pair for row in rows.values() for pair in row.props})
+        self._link_properties(set(variants.values()), {
+            (variants[sku], props[pair]) for sku, row in rows.items() for pair in row.props
+        })
+        # Поисковые документы пересчитываются только для изменившихся строк порции
+        update_search_vectors(set(variants.values()))
+
+    def _changed_rows(self, rows):
+        """
+        Отбор новых и изменившихся строк по сохранённым отпечаткам.
+
+        Возвращает строки для записи и их отпечатки: ({sku: строка}, {sku: отпечаток}).
+        """
+        stored = {
+            sku: (pk, row_hash) for sku, pk, row_hash in Pricelist.objects.filter(
+                seller=self.seller, variant__sku__in=rows.keys()
+            ).values_list('variant__sku', 'id', 'row_hash')
+        }
+        changed = {}
+        hashes = {}
+        unchanged = []
+        for sku, row in rows.items():
+            row_hash = fingerprint(row)
+            if sku not in stored:
+                self.stats['inserted'] += 1
+            elif stored[sku][1] == row_hash:
+                self.stats['unchanged'] += 1
+                unchanged.append(stored[sku][0])
+                continue
+            else:
+                self.stats['updated'] += 1
+            changed[sku] = row
+            hashes[sku] = row_hash
+        # Неизменившиеся строки не перезаписываются, но отмечаются выгрузкой
+        if unchanged and self.import_id is not None:
+            with connection.cursor() as cursor:
+                cursor.execute(MARK_IMPORTED_SQL, [self.import_id, unchanged])
+        return changed, hashes
+
+    def _resolve_titled(self, model, titles):
+        """Поиск/создание записей справочника с уникальным `title`: {title: id}"""
+        cache = self.caches[model.__name__]
+        found, missing = cache.lookup(titles)
+        if missing:
+            fetched = dict(model.objects.filter(title__in=missing).values_list('title', 'id'))
+            new = missing - fetched.keys()
+            if new:
+                model.objects.bulk_create(
+                    [model(title=title) for title in sorted(new)], ignore_conflicts=True)
+                fetched.update(model.objects.filter(title__in=new).values_list('title', 'id'))
+            cache.update(fetched)
+            found.update(fetched)
+        return found
+
+    def _resolve_products(self, keys):
+        """Поиск/создание товаров по ключу (category_id, brand_id, title): {ключ: id}"""
+        cache = self.caches['Product']
+        found, missing = cache.lookup(keys)
+        if missing:
+            fetched = self._select_products(missing)
+            new = missing - fetched.keys()
+            if new:
+                Product.objects.bulk_create([
+                    Product(category_id=category_id, brand_id=brand_id, title=title)
+                    for category_id, brand_id, title in sorted(new)
+                ], ignore_conflicts=True)
+                # Товары, созданные параллельным импортом, в ответе INSERT не вернутся -
+                # перечитываем
+                fetched.update(self._select_products(new))
+            cache.update(fetched)
+            found.update(fetched)
+        return found
+
+    @staticmethod
+    def _select_products(keys):
+        queryset = Product.objects.filter(
+            brand_id__in={key[1] for key in keys}, title__in={key[2] for key in keys}
+        ).values_list('category_id', 'brand_id', 'title', 'id')
+        return {
+            (category_id, brand_id, title): pk
+            for category_id, brand_id, title, pk in queryset
+            if (category_id, brand_id, title) in keys
+        }
+
+    @staticmethod
+    def _resolve_variants(sku_products):
+        """Поиск/создание модификаций по артикулу: {sku: id}"""
+        found = {}
+        moved = []
+        queryset = Variant.objects.filter(
+            sku__in=sku_products.keys()).values_list('sku', 'id', 'product_id')
+        for sku, pk, product_id in queryset:
+            found[sku] = pk
+            if product_id != sku_products[sku]:
+                moved.append(Variant(id=pk, product_id=sku_products[sku]))
+        if moved:
+            Variant.objects.bulk_update(sorted(moved, key=lambda obj: obj.id), ['product'])
+        missing = sku_products.keys() - found.keys()
+        if missing:
+            Variant.objects.bulk_create(
+                [Variant(sku=sku, product_id=sku_products[sku]) for sku in sorted(missing)],
+                ignore_conflicts=True)
+            found.update(Variant.objects.filter(sku__in=missing).values_list('sku', 'id'))
+        return found
+
+    def _save_prices(self, rows, hashes, variants):
+        """Запись цен продавца одним INSERT ... ON CONFLICT DO UPDATE по (seller, variant)"""
+        Pricelist.objects.bulk_create(
+            [
+                Pricelist(
+                    seller=self.seller,
+                    variant_id=variants[sku],
+                    row_hash=hashes[sku],
+                    import_id=self.import_id,
+                    **{field: getattr(row, field) for field in PRICE_FIELDS}
+                )
+                for sku, row in sorted(rows.items(), key=lambda item: variants[item[0]])
+            ],
+            update_conflicts=True,
+            # Django 4.1 подставляет имена полей в ON CONFLICT как есть, поэтому attname
+            unique_fields=['seller_id', 'variant_id'],
+            update_fields=[*PRICE_FIELDS, 'price_date', 'row_hash', 'import_id'])
+
+    def _resolve_properties(self, pairs):
+        """Поиск/создание характеристик по паре (title, value): {пара: id}"""
+        cache = self.caches['Property']
+        found, missing = cache.lookup(pairs)
+        if missing:
+            fetched = self._select_properties(missing)
+            new = missing - fetched.keys()
+            if new:
+                Property.objects.bulk_create(
+                    [Property(title=title, value=value) for title, value in sorted(new)],
+                    ignore_conflicts=True)
+                fetched.update(self._select_properties(new))
+            cache.update(fetched)
+            found.update(fetched)
+        return found
+
+    @staticmethod
+    def _select_properties(pairs):
+        queryset = Property.objects.filter(
+            title__in={pair[0] for pair in pairs}, value__in={pair[1] for pair in pairs}
+        ).values_list('title', 'value', 'id')
+        return {(title, value): pk for title, value, pk in queryset if (title, value) in pairs}
+
+    def _link_properties(self, variant_ids, links):
+        """
+        Привязка характеристик порции к модификациям `variant_ids`.
+
+        Новые связи (variant_id, property_id) записываются одним INSERT в промежуточную
+        таблицу `Variant.props` с пропуском уже существующих. В режиме `replace_props`
+        набор характеристик модификации заменяется: лишние связи удаляются одним
+        DELETE, совпадающие остаются на месте.
+        """
+        through = Variant.props.through
+        if self.replace_props:
+            existing = through.objects.filter(
+                variant_id__in=variant_ids).values_list('id', 'variant_id', 'property_id')
+            stale = []
+            for pk, variant_id, prop_id in existing:
+                if (variant_id, prop_id) in links:
+                    links.discard((variant_id, prop_id))
+                else:
+                    stale.append(pk)
+            if stale:
+                through.objects.filter(id__in=stale).delete()
+        if links:
+            through.objects.bulk_create(
+                [
+                    through(variant_id=variant_id, property_id=prop_id)
+                    for variant_id, prop_id in sorted(links)
+                ],
+                ignore_conflicts=True)
@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Prefetch
+from rest_framework.renderers import JSONRenderer
+
+from main.fast import FastJSONRenderer, get_values_serializer
+from main.models import Pricelist, Variant
+from main.serializers import ProductCompactSerializer, ProductListSerializer
+
+
+class Command(BaseCommand):
+    help = ('Сравнение сериализатора DRF и быстрой сериализации (main.fast) страницы '
+            'списка товаров на записях из базы: запросы, сериализация и JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500, help='Записей на странице')
+        parser.add_argument('--repeat', type=int, default=20, help='Количество повторов')
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        queryset = Variant.objects.select_related(
+            'product__brand', 'product__category').defer('search_vector').order_by('id')
+        if not queryset.exists():
+            raise CommandError('Каталог пуст - импортируйте прайс-лист')
+        prices = Prefetch('prices', queryset=Pricelist.objects.select_related(
+            'seller').order_by('id'))
+
+        for serializer_class, drf_queryset in [
+            (ProductListSerializer, queryset.prefetch_related(prices)),
+            (ProductCompactSerializer, queryset),
+        ]:
+            def drf_page():
+                data = serializer_class(drf_queryset[:rows], many=True).data
+                return JSONRenderer().render(data)
+
+            def fast_page():
+                serializer = get_values_serializer(serializer_class)
+                data = serializer.serialize(list(serializer.values(queryset)[:rows]))
+                return FastJSONRenderer().render(data)
+
+            drf_time = self.measure(drf_page, repeat)
+            fast_time = self.measure(fast_page, repeat)
+            count = len(drf_queryset[:rows])
+            self.stdout.write(
+                f'{serializer_class.__name__}, записей: {count}\n'
+                f'  DRF:     {drf_time * 1000:8.1f} мс, {count / drf_time:10.0f} записей/с\n'
+                f'  быстрая: {fast_time * 1000:8.1f} мс, {count / fast_time:10.0f} записей/с\n'
+                f'  ускорение: {drf_time / fast_time:.1f}x, '
+                f'ответ совпадает: {drf_page() == fast_page()}'
+            )
+
+    @staticmethod
+    def measure(func, repeat):
+        """Лучшее время из `repeat` запусков, секунд"""
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
@@ -0,0 +1,94 @@
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Sum
+from model_bakery import baker
+
+from main.models import Brand, Category, Order, OrderItem, Pricelist, Product, Variant
+from main.offers import OutOfStock, reserve_stock
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Параллельное оформление заказов с общими предложениями: списание остатков '
+            '(main.offers.reserve_stock) в транзакциях из нескольких потоков. Проверяет, '
+            'что продано не больше начального остатка. Данные удаляются по завершении')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=200, help='Количество покупателей')
+        parser.add_argument('--threads', type=int, default=8, help='Количество потоков')
+        parser.add_argument('--offers', type=int, default=20, help='Количество предложений')
+        parser.add_argument('--stock', type=int, default=50, help='Остаток каждого предложения')
+        parser.add_argument('--items', type=int, default=5, help='Позиций в корзине')
+
+    def handle(self, *args, **options):
+        category = baker.make(Category)
+        brand = baker.make(Brand)
+        users = []
+        try:
+            self.run(category, brand, users, options)
+        finally:
+            # Товары, предложения и заказы удаляются каскадом
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+            category.delete()
+            brand.delete()
+
+    def run(self, category, brand, users, options):
+        seller = baker.make(User, role='seller')
+        users.append(seller)
+        product = baker.make(Product, category=category, brand=brand)
+        pricelists = [
+            Pricelist.objects.create(variant=variant, seller=seller, in_stock=options['stock'],
+                                     product_price=100, delivery_price=10)
+            for variant in baker.make(Variant, product=product, _quantity=options['offers'])
+        ]
+        buyers = baker.make(User, role='buyer', _quantity=options['buyers'])
+        users.extend(buyers)
+        rng = random.Random(0)
+        carts = []
+        for buyer in buyers:
+            cart = Order.objects.create(customer=buyer, status='in_cart')
+            OrderItem.objects.bulk_create([
+                OrderItem(order=cart, pricelist=pricelist, quantity=rng.randint(1, 5))
+                for pricelist in rng.sample(pricelists, min(options['items'], len(pricelists)))
+            ])
+            carts.append(cart.id)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            results = Counter(executor.map(self.checkout, carts))
+        elapsed = time.perf_counter() - started
+
+        sold = OrderItem.objects.filter(
+            order_id__in=carts, order__status='accepted').aggregate(total=Sum('quantity'))
+        stock = Pricelist.objects.filter(
+            pk__in=[pricelist.pk for pricelist in pricelists]).aggregate(total=Sum('in_stock'))
+        initial = options['stock'] * len(pricelists)
+        self.stdout.write(
+            f'оформлено: {results["accepted"]}, отказано (нет остатка): {results["out_of_stock"]}\n'
+            f'время: {elapsed:.2f} с, {len(carts) / elapsed:.0f} оформлений/с '
+            f'в {options["threads"]} потоков\n'
+            f'начальный остаток: {initial}, продано: {sold["total"] or 0}, '
+            f'осталось: {stock["total"]}, '
+            f'без перепродажи: {(sold["total"] or 0) + stock["total"] == initial}'
+        )
+
+    @staticmethod
+    def checkout(cart_id):
+        """Оформление корзины так же, как в CartViewSet.cart_checkout"""
+        try:
+            with transaction.atomic():
+                cart = Order.objects.select_for_update().get(pk=cart_id)
+                try:
+                    reserve_stock(cart.id)
+                except OutOfStock:
+                    return 'out_of_stock'
+                cart.status = 'accepted'
+                cart.save(update_fields=['status'])
+                return 'accepted'
+        finally:
+            connection.close()
@@ -0,0 +1,62 @@
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from model_bakery import baker
+
+from main.models import Order, OrderItem, Pricelist
+from users.models import User
+from users.permissions import OrderPermission
+
+
+class Command(BaseCommand):
+    help = ('Время проверки доступа продавца к заказу (OrderPermission) в зависимости '
+            'от количества его заказов. Данные создаются во временной транзакции')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--history', type=int, nargs='+', default=[10, 1000, 20000],
+                            help='Количество заказов продавца')
+        parser.add_argument('--repeat', type=int, default=20, help='Количество повторов')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run(sorted(options['history']), options['repeat'])
+            transaction.set_rollback(True)
+
+    def run(self, history, repeat):
+        seller = baker.make(User, role='seller')
+        buyer = baker.make(User, role='buyer')
+        pricelist = baker.make(Pricelist, seller=seller)
+        view = SimpleNamespace(action='retrieve')
+        created = 0
+        for size in history:
+            orders = Order.objects.bulk_create(
+                [Order(customer=buyer, status='accepted') for _ in range(size - created)])
+            OrderItem.objects.bulk_create(
+                [OrderItem(order=order, pricelist=pricelist, quantity=1) for order in orders])
+            created = size
+            order = orders[-1]
+
+            def check():
+                request = SimpleNamespace(user=seller)
+                assert OrderPermission().has_object_permission(request, view, order)
+
+            def legacy_check():
+                # Проверка до перехода на EXISTS: выборка всех заказов продавца
+                assert order in Order.objects.filter(items__seller=seller)
+
+            self.stdout.write(
+                f'заказов: {size:6d}  EXISTS: {self.measure(check, repeat) * 1000:8.2f} мс  '
+                f'все заказы: {self.measure(legacy_check, repeat) * 1000:8.2f} мс')
+
+    @staticmethod
+    def measure(func, repeat):
+        """Лучшее время из `repeat` запусков, секунд"""
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 16:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pricelist',
+            name='row_hash',
+            field=models.CharField(blank=True, max_length=32, verbose_name='Отпечаток строки прайс-листа'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.1 on 2026-10-18 16:30
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicates(apps, schema_editor):
+    """Объединение дублей товаров и характеристик перед добавлением уникальности"""
+    Product = apps.get_model('main', 'Product')
+    Property = apps.get_model('main', 'Property')
+    Variant = apps.get_model('main', 'Variant')
+    through = Variant.props.through
+
+    duplicates = Product.objects.values('category', 'brand', 'title').annotate(
+        keep_id=Min('id'), count=Count('id')).filter(count__gt=1)
+    for group in duplicates:
+        others = Product.objects.filter(
+            category=group['category'], brand=group['brand'], title=group['title']
+        ).exclude(id=group['keep_id'])
+        Variant.objects.filter(product__in=others).update(product_id=group['keep_id'])
+        others.delete()
+
+    duplicates = Property.objects.values('title', 'value').annotate(
+        keep_id=Min('id'), count=Count('id')).filter(count__gt=1)
+    for group in duplicates:
+        others = Property.objects.filter(
+            title=group['title'], value=group['value']).exclude(id=group['keep_id'])
+        variant_ids = set(through.objects.filter(
+            property__in=others).values_list('variant_id', flat=True))
+        through.objects.bulk_create(
+            [through(variant_id=variant_id, property_id=group['keep_id'])
+             for variant_id in variant_ids],
+            ignore_conflicts=True)
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_pricelist_row_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='product',
+            unique_together={('category', 'brand', 'title')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='property',
+            unique_together={('title', 'value')},
+        ),
+    ]
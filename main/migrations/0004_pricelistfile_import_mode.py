@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 16:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_unique_product_property'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pricelistfile',
+            name='import_mode',
+            field=models.CharField(choices=[('chunk', 'Параллельно, каждая порция строк в своей транзакции'), ('file', 'Весь файл в одной транзакции')], default='chunk', max_length=5, verbose_name='Режим импорта'),
+        ),
+    ]
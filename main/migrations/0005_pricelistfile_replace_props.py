@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 16:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_pricelistfile_import_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pricelistfile',
+            name='replace_props',
+            field=models.BooleanField(default=False, verbose_name='Заменять характеристики товаров'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.1 on 2026-10-18 16:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('main', '0005_pricelistfile_replace_props'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PricelistUploadSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_name', models.CharField(max_length=255, verbose_name='Имя файла')),
+                ('file', models.FileField(upload_to='uploads/', verbose_name='Загружаемый файл')),
+                ('size', models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Размер файла')),
+                ('offset', models.PositiveBigIntegerField(default=0, verbose_name='Принято байт')),
+                ('import_mode', models.CharField(choices=[('chunk', 'Параллельно, каждая порция строк в своей транзакции'), ('file', 'Весь файл в одной транзакции')], default='chunk', max_length=5, verbose_name='Режим импорта')),
+                ('replace_props', models.BooleanField(default=False, verbose_name='Заменять характеристики товаров')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('pricelist_file', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='main.pricelistfile', verbose_name='Выгруженный прайс')),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Продавец')),
+            ],
+        ),
+    ]
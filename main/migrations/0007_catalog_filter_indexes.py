@@ -0,0 +1,28 @@
+# Generated by Django 4.1 on 2026-10-18 16:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_pricelistuploadsession'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pricelist',
+            index=models.Index(fields=['variant', 'product_price', 'in_stock'], name='pricelist_variant_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pricelist',
+            index=models.Index(fields=['product_price', 'variant'], name='pricelist_price_idx'),
+        ),
+        # Фильтр каталога по характеристике: поиск модификаций по property_id.
+        # Уникальный индекс таблицы связей начинается с variant_id и здесь не подходит
+        migrations.RunSQL(
+            'CREATE INDEX variant_props_property_idx '
+            'ON main_variant_props (property_id, variant_id);',
+            'DROP INDEX variant_props_property_idx;',
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.1 on 2026-10-18 16:40
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Заполнение поисковых документов существующих модификаций
+# (см. main.search.UPDATE_SEARCH_VECTOR_SQL)
+FILL_SEARCH_VECTOR_SQL = '''
+UPDATE main_variant AS variant SET search_vector =
+    setweight(to_tsvector('simple', brand.title || ' ' || product.title), 'A') ||
+    setweight(to_tsvector('simple', variant.sku), 'A') ||
+    setweight(to_tsvector('simple', coalesce((
+        SELECT string_agg(prop.title || ' ' || prop.value, ' ')
+        FROM main_variant_props AS link
+        JOIN main_property AS prop ON prop.id = link.property_id
+        WHERE link.variant_id = variant.id
+    ), '')), 'B')
+FROM main_product AS product
+JOIN main_brand AS brand ON brand.id = product.brand_id
+WHERE product.id = variant.product_id
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_catalog_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='variant',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        # Индекс строится по уже заполненной таблице
+        migrations.RunSQL(FILL_SEARCH_VECTOR_SQL, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='variant',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='variant_search_idx'),
+        ),
+    ]
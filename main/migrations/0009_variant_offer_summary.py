@@ -0,0 +1,65 @@
+# Generated by Django 4.1 on 2026-10-18 16:44
+
+from django.db import migrations, models
+
+# Заполнение сводки предложений существующих модификаций
+# (см. main.offers.UPDATE_OFFER_SUMMARY_SQL)
+FILL_OFFER_SUMMARY_SQL = '''
+UPDATE main_variant AS variant SET
+    min_price = summary.min_price,
+    min_landed_price = summary.min_landed_price,
+    offers_count = summary.offers_count,
+    total_stock = summary.total_stock
+FROM (
+    SELECT
+        variant_id,
+        min(product_price) AS min_price,
+        min(product_price::bigint + coalesce(delivery_price, 0)) AS min_landed_price,
+        count(*) AS offers_count,
+        sum(in_stock) AS total_stock
+    FROM main_pricelist
+    WHERE in_stock > 0
+    GROUP BY variant_id
+) AS summary
+WHERE variant.id = summary.variant_id
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_variant_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='variant',
+            name='min_landed_price',
+            field=models.PositiveBigIntegerField(editable=False, null=True, verbose_name='Минимальная цена с доставкой'),
+        ),
+        migrations.AddField(
+            model_name='variant',
+            name='min_price',
+            field=models.PositiveIntegerField(editable=False, null=True, verbose_name='Минимальная цена'),
+        ),
+        migrations.AddField(
+            model_name='variant',
+            name='offers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество предложений'),
+        ),
+        migrations.AddField(
+            model_name='variant',
+            name='total_stock',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Общий остаток'),
+        ),
+        # Индексы строятся по уже заполненной таблице
+        migrations.RunSQL(FILL_OFFER_SUMMARY_SQL, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='variant',
+            index=models.Index(fields=['min_price', 'id'], name='variant_min_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='variant',
+            index=models.Index(fields=['min_landed_price', 'id'], name='variant_min_landed_idx'),
+        ),
+    ]
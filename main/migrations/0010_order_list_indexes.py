@@ -0,0 +1,28 @@
+# Generated by Django 4.1 on 2026-10-18 16:54
+
+from django.db import migrations, models
+
+# Постраничная выдача заказов идёт по created_at: оформленные заказы без даты
+# (созданные не через оформление корзины) получают дату применения миграции
+FILL_CREATED_AT_SQL = '''
+UPDATE main_order SET created_at = now()
+WHERE created_at IS NULL AND status <> 'in_cart'
+'''
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_variant_offer_summary'),
+    ]
+
+    operations = [
+        migrations.RunSQL(FILL_CREATED_AT_SQL, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'status', 'created_at'], name='order_customer_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['pricelist', 'order'], name='orderitem_pricelist_order_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 17:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_order_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pricelist',
+            name='import_id',
+            field=models.PositiveBigIntegerField(editable=False, null=True, verbose_name='Последняя выгрузка'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 19:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_pricelist_import_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pricelistuploadsession',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
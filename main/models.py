@@ -1,4 +1,10 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.utils import timezone
 
 from users.models import User
 
@@ -24,6 +30,9 @@ class Product(models.Model):
         related_name='products_of_brand')
     title = models.CharField('Название товара/модель', max_length=255)
 
+    class Meta:
+        unique_together = ['category', 'brand', 'title']
+
     def __str__(self):
         return f'{self.brand.title} {self.title}'
 
@@ -32,6 +41,9 @@ class Property(models.Model):
     title = models.CharField('Характеристика', max_length=255)
     value = models.CharField('Значение', max_length=255)
 
+    class Meta:
+        unique_together = ['title', 'value']
+
 
 class Pricelist(models.Model):
     seller = models.ForeignKey(
@@ -42,18 +54,64 @@ class Pricelist(models.Model):
     delivery_price = models.PositiveIntegerField('Цена доставки', null=True)
     in_stock = models.SmallIntegerField('Количество', default=0)
     price_date = models.DateTimeField(auto_now_add=True)
+    # Отпечаток строки последней выгрузки - для пропуска неизменившихся строк
+    row_hash = models.CharField('Отпечаток строки прайс-листа', max_length=32, blank=True)
+    # id выгрузки (PricelistFile), в которой строка встретилась последний раз -
+    # по нему снимаются с продажи строки, которых нет в новой выгрузке
+    import_id = models.PositiveBigIntegerField('Последняя выгрузка', null=True, editable=False)
 
     class Meta:
         unique_together = ['seller', 'variant']
+        indexes = [
+            # Фильтр каталога по цене/наличию предложений модификации
+            models.Index(
+                fields=['variant', 'product_price', 'in_stock'],
+                name='pricelist_variant_price_idx'),
+            # Поиск модификаций по диапазону цены
+            models.Index(fields=['product_price', 'variant'], name='pricelist_price_idx'),
+        ]
 
 
 class PricelistFile(models.Model):
+    IMPORT_MODES = (
+        ('chunk', 'Параллельно, каждая порция строк в своей транзакции'),
+        ('file', 'Весь файл в одной транзакции'),
+    )
     seller = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Продавец')
     file = models.FileField(verbose_name='Прайс')
+    import_mode = models.CharField(
+        'Режим импорта', max_length=5, choices=IMPORT_MODES, default='chunk')
+    replace_props = models.BooleanField('Заменять характеристики товаров', default=False)
     upload_result = models.JSONField(blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
 
+class PricelistUploadSession(models.Model):
+    """Загрузка прайс-листа частями с возможностью продолжения после обрыва"""
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Продавец')
+    file_name = models.CharField('Имя файла', max_length=255)
+    file = models.FileField('Загружаемый файл', upload_to='uploads/')
+    size = models.PositiveBigIntegerField('Размер файла', null=True, blank=True)
+    offset = models.PositiveBigIntegerField('Принято байт', default=0)
+    import_mode = models.CharField(
+        'Режим импорта', max_length=5, choices=PricelistFile.IMPORT_MODES, default='chunk')
+    replace_props = models.BooleanField('Заменять характеристики товаров', default=False)
+    pricelist_file = models.OneToOneField(
+        PricelistFile,
+        on_delete=models.SET_NULL,
+        verbose_name='Выгруженный прайс',
+        null=True,
+        blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Время последней принятой части: от него отсчитывается срок незавершённой загрузки
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    @staticmethod
+    def expires_before():
+        """Незавершённые загрузки без новых частей с этого момента считаются брошенными"""
+        return timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_MAX_AGE)
+
+
 class Variant(models.Model):
     sku = models.CharField(max_length=50, unique=True)
     product = models.ForeignKey(
@@ -64,6 +122,28 @@ class Variant(models.Model):
     props = models.ManyToManyField(Property, verbose_name='Характеристики товара')
     pricelist = models.ManyToManyField(
         User, through=Pricelist, verbose_name='Цены товара')
+    # Поисковый документ (бренд, модель, артикул, характеристики),
+    # пересчитывается при импорте прайс-листа
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Сводка предложений в наличии, пересчитывается при импорте прайс-листа:
+    # минимальная цена, минимальная цена с доставкой, количество предложений
+    # и общий остаток у всех продавцов
+    min_price = models.PositiveIntegerField(
+        null=True, editable=False, verbose_name='Минимальная цена')
+    min_landed_price = models.PositiveBigIntegerField(
+        null=True, editable=False, verbose_name='Минимальная цена с доставкой')
+    offers_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Количество предложений')
+    total_stock = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Общий остаток')
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='variant_search_idx'),
+            # Сортировка каталога по цене
+            models.Index(fields=['min_price', 'id'], name='variant_min_price_idx'),
+            models.Index(fields=['min_landed_price', 'id'], name='variant_min_landed_idx'),
+        ]
 
     def __str__(self):
 
@@ -86,6 +166,12 @@ class OrderItem(models.Model):
         related_name='order_items')
     quantity = models.PositiveIntegerField('Количество', default=0)
 
+    class Meta:
+        indexes = [
+            # Заказы продавца: позиции по его предложениям
+            models.Index(fields=['pricelist', 'order'], name='orderitem_pricelist_order_idx'),
+        ]
+
 
 class Order(models.Model):
     STATUSES = (
@@ -107,3 +193,10 @@ class Order(models.Model):
     status = models.CharField('Статус заказа', max_length=9, choices=STATUSES, default='in_cart')
     address = models.CharField('Адрес доставки', max_length=255, blank=True)
     created_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Заказы покупателя с фильтром по статусу и дате
+            models.Index(fields=['customer', 'status', 'created_at'],
+                         name='order_customer_status_idx'),
+        ]
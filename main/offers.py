@@ -0,0 +1,109 @@
+from django.db import connection
+from psycopg2.errors import DeadlockDetected, SerializationFailure
+
+# Блокировка модификаций в порядке id перед пересчётом сводки
+LOCK_VARIANTS_SQL = 'SELECT id FROM main_variant WHERE id = ANY(%s) ORDER BY id FOR UPDATE'
+# Сводка предложений модификаций: учитываются только предложения в наличии
+UPDATE_OFFER_SUMMARY_SQL = '''
+UPDATE main_variant AS variant SET
+    min_price = summary.min_price,
+    min_landed_price = summary.min_landed_price,
+    offers_count = summary.offers_count,
+    total_stock = summary.total_stock
+FROM (
+    SELECT
+        ids.id,
+        min(price.product_price) AS min_price,
+        min(price.product_price::bigint + coalesce(price.delivery_price, 0)) AS min_landed_price,
+        count(price.id) AS offers_count,
+        coalesce(sum(price.in_stock), 0) AS total_stock
+    FROM unnest(%s) AS ids(id)
+    LEFT JOIN main_pricelist AS price
+        ON price.variant_id = ids.id AND price.in_stock > 0
+    GROUP BY ids.id
+) AS summary
+WHERE variant.id = summary.id
+'''
+
+
+def update_offer_summary(variant_ids):
+    """
+    Пересчёт сводки предложений модификаций `variant_ids` одним UPDATE.
+
+    Предложения одной модификации могут одновременно менять импорты разных
+    продавцов. Модификации сначала блокируются отдельным запросом, поэтому
+    UPDATE выполняется со снимком, в котором уже видны цены завершившегося
+    конкурирующего импорта.
+    """
+    if not variant_ids:
+        return
+    variant_ids = sorted(variant_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(LOCK_VARIANTS_SQL, [variant_ids])
+        cursor.execute(UPDATE_OFFER_SUMMARY_SQL, [variant_ids])
+
+
+# Предложения позиций заказа с количеством по каждому предложению. Блокируются
+# в порядке (variant_id, id) - в том же порядке импорт записывает цены продавца
+# (PricelistImporter._save_prices): оформления и импорт с общими предложениями
+# ждут друг друга, а не взаимоблокируются
+LOCK_ORDER_OFFERS_SQL = '''
+SELECT price.id, price.variant_id, price.in_stock, items.quantity
+FROM main_pricelist AS price
+JOIN (
+    SELECT pricelist_id, sum(quantity) AS quantity
+    FROM main_orderitem
+    WHERE order_id = %s
+    GROUP BY pricelist_id
+) AS items ON items.pricelist_id = price.id
+ORDER BY price.variant_id, price.id
+FOR UPDATE OF price
+'''
+# Списание остатков одним запросом: id предложений и количества - массивами.
+# Отпечаток строки сбрасывается: остаток больше не совпадает с прайс-листом,
+# и повторная выгрузка того же файла должна записать его заново
+RESERVE_STOCK_SQL = '''
+UPDATE main_pricelist AS price
+SET in_stock = price.in_stock - items.quantity, row_hash = ''
+FROM unnest(%s, %s) AS items(id, quantity)
+WHERE price.id = items.id
+'''
+# Ошибки PostgreSQL, после которых транзакцию можно повторить
+RETRYABLE_ERRORS = (DeadlockDetected, SerializationFailure)
+
+
+class OutOfStock(Exception):
+    """Остатка предложения не хватает для позиции заказа"""
+
+    def __init__(self, pricelist_id, in_stock):
+        super().__init__(pricelist_id, in_stock)
+        self.pricelist_id = pricelist_id
+        self.in_stock = in_stock
+
+
+def reserve_stock(order_id):
+    """
+    Списание остатков предложений по позициям заказа `order_id`. Вызывается
+    в транзакции оформления заказа: блокировки предложений держатся до её конца.
+
+    Остатки проверяются по заблокированным строкам, поэтому параллельные
+    оформления не продают больше, чем есть. При нехватке поднимается OutOfStock
+    и ничего не списывается. Возвращает id модификаций заказа - их сводку
+    предложений пересчитывают после фиксации транзакции (tasks.refresh_offer_summary),
+    чтобы оформление не ждало блокировок модификаций, которые держит импорт.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(LOCK_ORDER_OFFERS_SQL, [order_id])
+        rows = cursor.fetchall()
+        for pricelist_id, _, in_stock, quantity in rows:
+            if quantity > in_stock:
+                raise OutOfStock(pricelist_id, in_stock)
+        if rows:
+            cursor.execute(RESERVE_STOCK_SQL, [
+                [row[0] for row in rows], [row[3] for row in rows]])
+    return {row[1] for row in rows}
+
+
+def is_retryable(exc):
+    """Ошибка базы (OperationalError) - взаимоблокировка или конфликт сериализации"""
+    return isinstance(exc.__cause__, RETRYABLE_ERRORS)
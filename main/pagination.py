@@ -0,0 +1,113 @@
+import json
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination, PageNumberPagination
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Keyset-пагинация по всем полям сортировки.
+
+    CursorPagination DRF запоминает в курсоре только первое поле сортировки,
+    а одинаковые значения пропускает через OFFSET (не больше offset_cutoff).
+    Здесь в курсор записываются значения всех полей, а страница выбирается
+    сравнением строк `(поле, id) > (%s, %s)` - без OFFSET, по индексу (поле, id).
+    Последнее поле сортировки должно быть уникальным (id, sku), направление
+    у всех полей одно.
+    """
+    ordering = ('id',)
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = bool(self.cursor and self.cursor.reverse)
+        # Сортировка запроса: для ссылки previous страница читается в обратном порядке
+        descending = self.ordering[0].startswith('-') != reverse
+        fields = [field.lstrip('-') for field in self.ordering]
+        queryset = queryset.order_by(*(f'-{field}' if descending else field for field in fields))
+        if self.cursor and self.cursor.position is not None:
+            queryset = self.filter_after(queryset, fields, self.decode_position(fields), descending)
+        
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+    
+    @staticmethod
+    def filter_after(queryset, fields, values, descending):
+        """Записи после позиции `values` по полям `fields` - одним сравнением строк"""
+        model = queryset.model
+        columns = ', '.join(
+            f'{model._meta.db_table}.{model._meta.get_field(field).column}' for field in fields)
+        placeholders = ', '.join(['%s'] * len(values))
+        operator = '<' if descending else '>'
+        return queryset.extra(where=[f'({columns}) {operator} ({placeholders})'], params=values)
+    
+    def decode_position(self, fields):
+        try:
+            values = json.loads(self.cursor.position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+    
+    def get_position(self, instance):
+        return json.dumps([
+            instance[field] if isinstance(instance, dict) else getattr(instance, field)
+            for field in (field.lstrip('-') for field in self.ordering)
+        ])
+    
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=False, position=self.get_position(self.page[-1])))
+    
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=True, position=self.get_position(self.page[0])))
+
+
+class ProductCursorPagination(KeysetCursorPagination):
+    """
+    Keyset-пагинация каталога: по id или по цене и id (см. filters.get_product_ordering).
+    Следующая страница выбирается условием `(min_price, id) > последняя позиция`,
+    без OFFSET, поэтому глубокие страницы стоят столько же, сколько первая -
+    и при большом количестве модификаций с одинаковой ценой.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class ProductPageNumberPagination(PageNumberPagination):
+    """Постраничная навигация по номеру страницы (?page=) - для перехода на произвольную страницу"""
+    page_size = ProductCursorPagination.page_size
+    page_size_query_param = 'page_size'
+    max_page_size = ProductCursorPagination.max_page_size
+
+
+class OrderCursorPagination(CursorPagination):
+    """
+    Keyset-пагинация заказов: новые первыми, по дате оформления и id.
+    Следующая страница выбирается условием на created_at, без OFFSET.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
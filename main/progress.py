@@ -0,0 +1,66 @@
+import time
+
+from django.core.cache import cache
+
+# Время хранения прогресса импорта, если задача завершилась аварийно
+PROGRESS_TIMEOUT = 60 * 60 * 24
+PROGRESS_FIELDS = ['phase', 'rows_total', 'rows_processed', 'started_at']
+
+
+def _key(instance_id, field):
+    return f'pricelist:{instance_id}:{field}'
+
+
+def start_phase(instance_id, phase, rows_total=None):
+    """Начало этапа импорта: счётчик обработанных строк и время начала сбрасываются"""
+    cache.set_many({
+        _key(instance_id, 'phase'): phase,
+        _key(instance_id, 'rows_total'): rows_total,
+        _key(instance_id, 'rows_processed'): 0,
+        _key(instance_id, 'started_at'): time.time(),
+    }, PROGRESS_TIMEOUT)
+
+
+def advance(instance_id, rows):
+    """
+    Увеличение счётчика обработанных строк.
+
+    Вызывается раз в порцию строк, а не на каждую строку. Инкремент атомарный,
+    поэтому счётчик могут увеличивать параллельно импортирующие задачи.
+    """
+    try:
+        cache.incr(_key(instance_id, 'rows_processed'), rows)
+    except ValueError:
+        # Ключ удалён или истёк - прогресс не критичен для импорта
+        pass
+
+
+def finish(instance_id):
+    cache.delete_many([_key(instance_id, field) for field in PROGRESS_FIELDS])
+
+
+def get_progress(instance_id):
+    """
+    Текущий прогресс импорта: этап, количество обработанных строк, скорость
+    (строк в секунду) и оценка оставшегося времени в секундах.
+
+    Возвращает None, если импорт не выполняется.
+    """
+    data = cache.get_many([_key(instance_id, field) for field in PROGRESS_FIELDS])
+    if not data:
+        return None
+    data = {field: data.get(_key(instance_id, field)) for field in PROGRESS_FIELDS}
+    rows_total = data['rows_total']
+    rows_processed = data['rows_processed'] or 0
+    elapsed = time.time() - (data['started_at'] or time.time())
+    rows_per_second = rows_processed / elapsed if elapsed > 0 else 0
+    eta = None
+    if rows_total is not None and rows_per_second:
+        eta = round(max(rows_total - rows_processed, 0) / rows_per_second)
+    return {
+        'phase': data['phase'],
+        'rows_processed': rows_processed,
+        'rows_total': rows_total,
+        'rows_per_second': round(rows_per_second, 1),
+        'eta_seconds': eta,
+    }
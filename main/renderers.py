@@ -0,0 +1,23 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+def format_event(event, data):
+    """Сообщение Server-Sent Events с данными в JSON"""
+    return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Рендерер для потоков Server-Sent Events.
+
+    Сам поток отдаётся через StreamingHttpResponse, рендерер нужен для согласования
+    `Accept: text/event-stream` и для ответов с ошибками (403, 404 и т.п.).
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return format_event('error', data).encode(self.charset)
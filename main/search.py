@@ -0,0 +1,53 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F
+
+# Конфигурация полнотекстового поиска: без стемминга, т.к. документ состоит
+# из названий брендов и моделей, артикулов и значений характеристик на разных языках
+SEARCH_CONFIG = 'simple'
+# Максимальное количество слов поискового запроса
+MAX_SEARCH_WORDS = 10
+
+# Поисковый документ модификации: бренд, модель и артикул (вес A),
+# характеристики (вес B)
+UPDATE_SEARCH_VECTOR_SQL = f'''
+UPDATE main_variant AS variant SET search_vector =
+    setweight(to_tsvector('{SEARCH_CONFIG}', brand.title || ' ' || product.title), 'A') ||
+    setweight(to_tsvector('{SEARCH_CONFIG}', variant.sku), 'A') ||
+    setweight(to_tsvector('{SEARCH_CONFIG}', coalesce((
+        SELECT string_agg(prop.title || ' ' || prop.value, ' ')
+        FROM main_variant_props AS link
+        JOIN main_property AS prop ON prop.id = link.property_id
+        WHERE link.variant_id = variant.id
+    ), '')), 'B')
+FROM main_product AS product
+JOIN main_brand AS brand ON brand.id = product.brand_id
+WHERE product.id = variant.product_id AND variant.id = ANY(%s)
+'''
+
+
+def update_search_vectors(variant_ids):
+    """Пересчёт поисковых документов модификаций `variant_ids` одним UPDATE"""
+    if not variant_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(UPDATE_SEARCH_VECTOR_SQL, [sorted(variant_ids)])
+
+
+def search_products(queryset, text):
+    """
+    Поиск модификаций по словам запроса с сортировкой по релевантности.
+
+    Каждое слово ищется как префикс («gal s20» находит «Galaxy S20»), совпасть
+    должны все слова. Запрос собирается только из буквенно-цифровых слов,
+    поэтому синтаксис tsquery в тексте пользователя не интерпретируется.
+    """
+    words = re.findall(r'\w+', text.lower())[:MAX_SEARCH_WORDS]
+    if not words:
+        return queryset.none()
+    query = SearchQuery(
+        ' & '.join(f'{word}:*' for word in words), config=SEARCH_CONFIG, search_type='raw')
+    return queryset.filter(search_vector=query).annotate(
+        rank=SearchRank(F('search_vector'), query)).order_by('-rank', 'id')
@@ -1,33 +1,141 @@
+from collections import Counter
+
+from django.core.files.base import ContentFile
 from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from rest_framework.reverse import reverse
 
-from main.models import PricelistFile, Variant, Property, Pricelist, Order, OrderItem
+from main.importer import detect_format, parquet_available
+from main.models import (
+    PricelistFile, PricelistUploadSession, Variant, Property, Pricelist, Order, OrderItem
+)
+from main.progress import get_progress
 from main.tasks import parse_pricelist
 from main.utils import get_totals
 
 
+def validate_pricelist_name(file_name):
+    file_format = detect_format(file_name)
+    if file_format is None:
+        raise ValidationError(
+            'Unsupported file format, expected .csv, .jsonl, .ndjson (optionally .gz) '
+            'or .parquet')
+    if file_format == 'parquet' and file_name.lower().endswith('.gz'):
+        # Parquet сжимается внутри файла, gzip-поток читался бы как текст
+        raise ValidationError('Parquet files cannot be compressed with gzip')
+    if file_format == 'parquet' and not parquet_available():
+        raise ValidationError('Parquet files are not supported on this server')
+    return file_name
+
+
+def parse_field_list(params, name):
+    """Список имён из параметра запроса `name` через запятую, None - параметра нет"""
+    if name not in params:
+        return None
+    return {item.strip() for item in params[name].split(',') if item.strip()}
+
+
+class SparseFieldsMixin:
+    """
+    Выбор полей ответа параметрами GET-запроса.
+
+    ?fields=id,sku - только перечисленные поля. ?expand=prices - какие вложенные
+    объекты включать (пустое значение - ни одного), без expand вложенные объекты
+    выбираются параметром fields так же, как остальные поля. Вложенными считаются
+    поля-сериализаторы и поля из `expandable_fields`.
+    """
+    expandable_fields = []
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return fields
+        selected = parse_field_list(request.query_params, 'fields')
+        expanded = parse_field_list(request.query_params, 'expand')
+        nested = {
+            name for name, field in fields.items()
+            if isinstance(field, serializers.BaseSerializer) or name in self.expandable_fields
+        }
+        if selected is not None and selected - fields.keys():
+            raise ValidationError(
+                {'fields': f'unknown fields {sorted(selected - fields.keys())}, '
+                           f'expected {list(fields)}'})
+        if expanded is not None and expanded - nested:
+            raise ValidationError(
+                {'expand': f'unknown fields {sorted(expanded - nested)}, '
+                           f'expected {sorted(nested)}'})
+        for name in list(fields):
+            if name in nested and expanded is not None:
+                included = name in expanded
+            else:
+                included = selected is None or name in selected
+            if not included:
+                del fields[name]
+        return fields
+
+
 class PricelistUploadSerializer(serializers.ModelSerializer):
     result_check_endpoint = serializers.SerializerMethodField()
     file = serializers.FileField(write_only=True)
     upload_result = serializers.JSONField(default={'status': 'parsing'})
+    progress = serializers.SerializerMethodField()
     
     class Meta:
         model = PricelistFile
-        fields = ['file', 'upload_result', 'result_check_endpoint']
+        fields = ['file', 'import_mode', 'replace_props', 'upload_result', 'progress',
+                  'result_check_endpoint']
+    
+    def validate_file(self, value):
+        validate_pricelist_name(value.name)
+        return value
     
     def create(self, validated_data):
         instance = super().create(validated_data)
         parse_pricelist.delay(instance.id)
         return instance
     
+    @extend_schema_field(serializers.JSONField)
+    def get_progress(self, obj):
+        return get_progress(obj.id)
+    
     @extend_schema_field(serializers.URLField)
     def get_result_check_endpoint(self, obj) -> str:
         request = self.context['request']
         return reverse('upload-detail', kwargs={'pk': obj.id}, request=request)
 
 
+class PricelistUploadSessionSerializer(serializers.ModelSerializer):
+    chunk_endpoint = serializers.SerializerMethodField()
+    commit_endpoint = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = PricelistUploadSession
+        fields = ['id', 'file_name', 'size', 'offset', 'import_mode', 'replace_props',
+                  'pricelist_file', 'chunk_endpoint', 'commit_endpoint']
+        read_only_fields = ['offset', 'pricelist_file']
+    
+    def validate_file_name(self, value):
+        return validate_pricelist_name(value)
+    
+    def create(self, validated_data):
+        instance = super().create(validated_data)
+        # Пустой файл в MEDIA_ROOT, в который будут дописываться части
+        instance.file.save(instance.file_name, ContentFile(b''))
+        return instance
+    
+    @extend_schema_field(serializers.URLField)
+    def get_chunk_endpoint(self, obj) -> str:
+        request = self.context['request']
+        return reverse('upload-sessions-chunk', kwargs={'pk': obj.id}, request=request)
+    
+    @extend_schema_field(serializers.URLField)
+    def get_commit_endpoint(self, obj) -> str:
+        request = self.context['request']
+        return reverse('upload-sessions-commit', kwargs={'pk': obj.id}, request=request)
+
+
 class PropertySerializer(serializers.ModelSerializer):
     class Meta:
         model = Property
@@ -45,7 +153,7 @@ class PricelistSerializer(serializers.ModelSerializer):
         ]
 
 
-class ProductListSerializer(serializers.ModelSerializer):
+class ProductListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     brand = serializers.CharField(source='product.brand.title')
     title = serializers.CharField(source='product.title')
     category = serializers.CharField(source='product.category.title')
@@ -56,7 +164,18 @@ class ProductListSerializer(serializers.ModelSerializer):
         fields = ['id', 'sku', 'brand', 'title', 'category', 'prices']
 
 
-class ProductDetailSerializer(serializers.ModelSerializer):
+class ProductCompactSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    brand = serializers.CharField(source='product.brand.title')
+    title = serializers.CharField(source='product.title')
+    category = serializers.CharField(source='product.category.title')
+    
+    class Meta:
+        model = Variant
+        fields = ['id', 'sku', 'brand', 'title', 'category', 'min_price',
+                  'min_landed_price', 'offers_count', 'total_stock']
+
+
+class ProductDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     brand = serializers.CharField(source='product.brand.title')
     title = serializers.CharField(source='product.title')
     category = serializers.CharField(source='product.category.title')
@@ -79,7 +198,43 @@ class OrderPricelistSerializer(serializers.ModelSerializer):
         ]
 
 
+class OrderItemListSerializer(serializers.ListSerializer):
+    """
+    Позиции корзины проверяются пакетом: все предложения читаются одним
+    запросом, с остатком сверяется суммарное количество позиций предложения
+    (как при списании в offers.reserve_stock).
+    """
+    
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        quantities = Counter()
+        for item in items:
+            quantities[item['pricelist_id']] += item['quantity']
+        pricelists = Pricelist.objects.only('id', 'variant_id', 'in_stock').in_bulk(
+            quantities.keys())
+        errors = []
+        for item in items:
+            obj = pricelists.get(item['pricelist_id'])
+            if obj is None:
+                errors.append({'pricelist': [
+                    f'Invalid pk "{item["pricelist_id"]}" - object does not exist.']})
+            elif quantities[obj.id] > obj.in_stock:
+                errors.append({'quantity': {
+                    'pricelist_id': obj.id,
+                    'product': obj.variant,
+                    'in stock': obj.in_stock
+                }})
+            else:
+                errors.append({})
+        if any(errors):
+            raise ValidationError(errors)
+        return items
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
+    # id предложения без запроса к Pricelist на каждую позицию:
+    # наличие предложений проверяет OrderItemListSerializer
+    pricelist = serializers.IntegerField(source='pricelist_id')
     product = serializers.StringRelatedField(source='pricelist.variant')
     product_price = serializers.IntegerField(
         source='pricelist.product_price', required=False)
@@ -89,35 +244,28 @@ class OrderItemSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = OrderItem
+        list_serializer_class = OrderItemListSerializer
         fields = ['pricelist', 'product', 'product_price', 'delivery_price',
                   'quantity', 'seller']
         read_only_fields = ['product', 'product_price', 'delivery_price']
-    
-    def validate_quantity(self, value):
-        pricelist = self.initial_data[0]['pricelist']
-        obj = Pricelist.objects.filter(pk=pricelist).first()
-        if obj:
-            if value > obj.in_stock:
-                raise ValidationError({
-                    'pricelist_id': obj.id,
-                    'product': obj.variant,
-                    'in stock': obj.in_stock
-                })
-            return value
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     summary = serializers.SerializerMethodField()
     items = OrderItemSerializer(source='order_items', many=True)
     
     @extend_schema_field(serializers.JSONField)
     def get_summary(self, obj):
-        items = obj.order_items.all()
-        if 'request' in self.context:
-            user = self.context['request'].user
-            if user and user.role == 'seller':
-                items = obj.order_items.filter(pricelist__seller=user)
-        products, delivery = get_totals(items)
+        # Суммы, посчитанные в запросе списка заказов (main.utils.annotate_totals)
+        if hasattr(obj, 'products_total'):
+            products, delivery = obj.products_total, obj.delivery_total
+        else:
+            items = obj.order_items.all()
+            if 'request' in self.context:
+                user = self.context['request'].user
+                if user and user.role == 'seller':
+                    items = obj.order_items.filter(pricelist__seller=user)
+            products, delivery = get_totals(items)
         return {'products_total': products,
                 'delivery_total': delivery,
                 'total': products + delivery}
@@ -156,6 +304,7 @@ class SellerOrderListSerializer(SellerOrderSerializer):
 
 class SellerOrderDetailSerializer(SellerOrderSerializer):
     items = serializers.SerializerMethodField()
+    expandable_fields = ['items']
     
     class Meta:
         model = Order
@@ -163,8 +312,12 @@ class SellerOrderDetailSerializer(SellerOrderSerializer):
                   'summary', 'items']
     
     def get_items(self, obj):
-        user = self.context['request'].user
-        items = obj.order_items.filter(pricelist__seller=user)
+        # Позиции продавца, загруженные в OrderViewSet.get_queryset
+        if hasattr(obj, 'visible_items'):
+            items = obj.visible_items
+        else:
+            user = self.context['request'].user
+            items = obj.order_items.filter(pricelist__seller=user)
         return SellerOrderItemSerializer(items, many=True).data
 
 
@@ -177,9 +330,7 @@ class CartSerializer(OrderSerializer):
     def create(self, validated_data):
         items = validated_data.pop('order_items')
         cart = Order.objects.create(**validated_data)
-        for item in items:
-            OrderItem.objects.create(
-                order=cart, pricelist=item['pricelist'], quantity=item['quantity'])
+        OrderItem.objects.bulk_create([OrderItem(order=cart, **item) for item in items])
         cart.refresh_from_db()
         return cart
 
@@ -1,85 +1,182 @@
-import os
+from collections import Counter
+from functools import partial
 
+from celery import chord
+from celery.utils.log import get_task_logger
 from django.core.mail import EmailMessage
+from django.db import transaction
 
 from config.django_celery import app
-from main.models import Pricelist, Category, Brand, PricelistFile, Product, Variant, Property, Order
+from main import catalog_cache, progress
+from main.importer import (
+    PricelistImporter, read_pricelist, split_shards, validate_pricelist
+)
+from main.models import PricelistFile, PricelistUploadSession, Order
+from main.offers import update_offer_summary
 from main.utils import get_totals
 
+logger = get_task_logger(__name__)
+
+
+def fail_pricelist_import(instance_id, exc):
+    """
+    Завершение импорта с ошибкой: выгрузка получает итоговый статус `failed`
+    (а не остаётся в `parsing`), файл удаляется.
+    """
+    file = PricelistFile.objects.get(pk=instance_id)
+    file.upload_result = {'status': 'failed', 'error': f'Import failed ({type(exc).__name__})'}
+    file.file.delete()
+    file.save()
+    progress.finish(instance_id)
+
 
 @app.task
 def parse_pricelist(instance_id):
-    def validate_upload_format(line_number, items):
-        # Если кол-во "столбцов" чётное - значит не заполнены какие-то поля характеристик
-        if len(items) % 2 == 0:
-            return {
-                'line': line_number,
-                'detail': 'wrong column count (not enough `characteristic-value` pairs)'
-            }
-        # Маппинг столбцов по типу данных (кроме характеристик)
-        index_type_map = {
-            0: [str, 'category title'],
-            1: [str, 'brand name'],
-            2: [str, 'product model'],
-            3: [str, 'product sku'],
-            4: [int, 'in_stock'],
-            5: [int, 'price'],
-            6: [int, 'delivery price']
+    """
+    Импорт прайс-листа.
+
+    Сначала проверяется весь файл - при ошибках в базу ничего не пишется.
+    В режиме `file` файл импортируется в одной транзакции, в режиме `chunk`
+    файл разбивается на диапазоны строк, которые импортируются параллельно,
+    результаты объединяются в `finish_pricelist_import`.
+    При непредвиденной ошибке выгрузка получает статус `failed`.
+    """
+    try:
+        _parse_pricelist(instance_id)
+    except Exception as exc:
+        fail_pricelist_import(instance_id, exc)
+        raise
+
+
+def _parse_pricelist(instance_id):
+    file = PricelistFile.objects.get(pk=instance_id)
+    progress.start_phase(instance_id, 'validating')
+    validation = validate_pricelist(file.file, partial(progress.advance, instance_id))
+    if validation.errors:
+        file.upload_result = {
+            'errors': validation.errors,
+            'errors_total': validation.errors_total
         }
+        file.file.delete()
+        file.save()
+        progress.finish(instance_id)
+        return
+
+    progress.start_phase(instance_id, 'importing', validation.rows_total)
+
+    if file.import_mode == 'file':
+        importer = PricelistImporter(file.seller, file.replace_props, file.id)
+        importer.warm_up()
+        with transaction.atomic():
+            for chunk in read_pricelist(file.file):
+                importer.import_chunk(chunk)
+                progress.advance(instance_id, len(chunk))
+            progress.start_phase(instance_id, 'finishing')
+            if validation.rows_total:
+                importer.remove_missing()
+        catalog_cache.invalidate(importer.changed_variants)
+        file.upload_result = {'status': 'parsed successfully', **importer.result}
+        file.file.delete()
+        file.save()
+        progress.finish(instance_id)
+        return
+
+    shards = [
+        (start, stop, resume) for (start, stop), resume
+        in zip(split_shards(validation.rows_total), validation.shard_starts)
+    ]
+    if len(shards) > 1:
+        # Ошибка любого диапазона (или объединения) завершает импорт статусом `failed`
+        chord(
+            import_pricelist_shard.s(instance_id, *shard) for shard in shards
+        )(finish_pricelist_import.s(instance_id).on_error(
+            pricelist_import_failed.s(instance_id)))
+    else:
+        results = [import_pricelist_shard(instance_id, *shard) for shard in shards]
+        finish_pricelist_import(results, instance_id)
 
-        for ix, item in enumerate(items[:7]):
-            item_type = index_type_map[ix][0]
-            item_field = index_type_map[ix][1]
 
-            try:
-                item_value = int(item)
-            except ValueError:
-                item_value = item
+@app.task
+def pricelist_import_failed(request, exc, traceback, instance_id):
+    """Обработчик ошибки chord импорта по диапазонам: итоговый статус `failed`"""
+    fail_pricelist_import(instance_id, exc)
+
 
-            if not isinstance(item_value, item_type):
-                return {
-                    'line': line_number,
-                    'value': item,
-                    'detail': f'Field `{item_field}` (index {ix}) must be of type {item_type}'
-                }
-        return None
+@app.task
+def import_pricelist_shard(instance_id, start, stop, resume=None):
+    """
+    Импорт строк прайс-листа с `start` по `stop`, каждая порция - в своей транзакции.
+    Чтение начинается с позиции `resume` строки `start`, найденной при проверке файла.
 
+    Ошибка не прерывает chord: она возвращается в результате диапазона
+    и объединяется с результатами остальных в `finish_pricelist_import`.
+    """
+    file = PricelistFile.objects.get(pk=instance_id)
+    importer = PricelistImporter(file.seller, file.replace_props, file.id)
+    result = {}
+    try:
+        importer.warm_up()
+        for chunk in read_pricelist(file.file, start=start, stop=stop, resume=resume):
+            importer.import_chunk(chunk)
+            progress.advance(instance_id, len(chunk))
+    except Exception as exc:
+        logger.exception('Pricelist %s: import of rows %s-%s failed', instance_id, start, stop)
+        result['error'] = {'rows': [start, stop], 'detail': f'Import failed ({type(exc).__name__})'}
+    catalog_cache.invalidate(importer.changed_variants)
+    return {**importer.result, **result}
+
+
+@app.task
+def finish_pricelist_import(results, instance_id):
+    """
+    Объединение результатов импорта диапазонов в `upload_result`: счётчики
+    суммируются, ошибки диапазонов собираются в список.
+    """
     file = PricelistFile.objects.get(pk=instance_id)
-    # Значение по-умолчанию - выгрузка успешна, если в процессе не будет ошибок
-    file.upload_result = {'status': 'parsed successfully'}
-    seller = file.seller
-    path = os.path.join(file.file.name)
-    with open(path) as f:
-        for line_number, line in enumerate(f.readlines()[1:]):
-            items = line.split(',')
-            # Валидация строки файла на соответствие формату
-            error = validate_upload_format(line_number + 1, items)
-            if error:
-                file.upload_result = {'error': error}
-                file.save()
-                break
-            category, _ = Category.objects.get_or_create(title=items[0].lower().strip())
-            brand, _ = Brand.objects.get_or_create(title=items[1].lower().strip())
-            product, _ = Product.objects.get_or_create(
-                category=category, brand=brand, title=items[2].lower().strip()
-            )
-            sku = items[3].strip()
-            variant, _ = Variant.objects.get_or_create(sku=sku, product=product)
-            pl = Pricelist.objects.filter(variant=variant, seller=seller).first()
-            if not pl:
-                pl = Pricelist.objects.create(variant=variant, seller=seller)
-            pl.in_stock = items[4]
-            pl.product_price = items[5]
-            pl.delivery_price = items[6]
-            pl.save()
-            # Создаём записи с парами: название характеристики - значение
-            for ind in range(7, len(items), 2):
-                prop, _ = Property.objects.get_or_create(
-                    title=items[ind].lower().strip(), value=items[ind + 1].lower().strip())
-                variant.props.add(prop)
+    progress.start_phase(instance_id, 'finishing')
+    importer = PricelistImporter(file.seller, import_id=file.id)
+    totals = Counter()
+    errors = []
+    for result in results:
+        if 'error' in result:
+            errors.append(result.pop('error'))
+        totals.update(result)
+    if errors:
+        # Выгрузка импортирована не полностью - позиции с продажи не снимаются
+        file.upload_result = {'status': 'failed', 'errors': errors, **totals}
+    else:
+        # Выгрузка импортирована полностью - отсутствующие в ней позиции снимаются
+        # с продажи (пустой файл считаем ошибочным и цены не трогаем)
+        if results:
+            importer.remove_missing()
+            catalog_cache.invalidate(importer.changed_variants)
+        totals['removed'] += importer.stats['removed']
+        file.upload_result = {'status': 'parsed successfully', **totals}
     # Удаляем файл после парсинга
     file.file.delete()
     file.save()
+    progress.finish(instance_id)
+
+
+@app.task
+def refresh_offer_summary(variant_ids):
+    """Пересчёт сводки предложений после списания остатков заказом и сброс кэша каталога"""
+    with transaction.atomic():
+        update_offer_summary(variant_ids)
+    catalog_cache.invalidate(variant_ids)
+
+
+@app.task
+def cleanup_upload_sessions():
+    """
+    Удаление брошенных загрузок частями: незавершённые сессии без новых частей
+    дольше UPLOAD_SESSION_MAX_AGE удаляются вместе с недогруженными файлами.
+    """
+    expired = PricelistUploadSession.objects.filter(
+        pricelist_file__isnull=True, updated_at__lt=PricelistUploadSession.expires_before())
+    for session in expired.iterator():
+        session.file.delete(save=False)
+        session.delete()
 
 
 @app.task
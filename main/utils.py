@@ -1,7 +1,26 @@
-from django.db.models import Sum, F
+from django.db.models import Q, Sum, F
+from django.db.models.functions import Coalesce
 
 
 def get_totals(items):
-    products = items.aggregate(pr=Sum(F('pricelist__product_price') * F('quantity')))['pr']
-    delivery = items.aggregate(dl=Sum(F('pricelist__delivery_price') * F('quantity')))['dl']
-    return products or 0, delivery or 0
+    """Стоимость товаров и доставки позиций заказа одним агрегирующим запросом"""
+    totals = items.aggregate(
+        products=Sum(F('pricelist__product_price') * F('quantity')),
+        delivery=Sum(F('pricelist__delivery_price') * F('quantity')))
+    return totals['products'] or 0, totals['delivery'] or 0
+
+
+def annotate_totals(orders, seller=None):
+    """
+    Стоимость товаров и доставки каждого заказа в запросе списка заказов
+    (products_total, delivery_total). Для продавца учитываются только
+    его позиции - условием агрегата, без отдельного запроса на заказ.
+    """
+    items = Q(order_items__pricelist__seller=seller) if seller is not None else None
+    return orders.annotate(
+        products_total=Coalesce(Sum(
+            F('order_items__pricelist__product_price') * F('order_items__quantity'),
+            filter=items), 0),
+        delivery_total=Coalesce(Sum(
+            F('order_items__pricelist__delivery_price') * F('order_items__quantity'),
+            filter=items), 0))
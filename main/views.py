@@ -1,15 +1,40 @@
+import time
+from functools import partial
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.db.models import Exists, OuterRef, Prefetch
+from django.http import StreamingHttpResponse
 from django.utils import timezone
-from drf_spectacular.utils import extend_schema, OpenApiExample
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema, OpenApiExample, OpenApiParameter
 from rest_framework import viewsets, mixins
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.response import Response
 
-from main import examples
-from main.models import PricelistFile, Variant, Order, OrderItem
+from main import catalog_cache, examples
+from main.fast import FastJSONRenderer, get_values_serializer
+from main.filters import (
+    ORDER_STATUSES, PRODUCT_ORDERINGS, filter_orders, filter_products, get_product_ordering,
+    order_products
+)
+from main.models import (
+    PricelistFile, PricelistUploadSession, Pricelist, Variant, Order, OrderItem
+)
+from main.offers import OutOfStock, is_retryable, reserve_stock
+from main.pagination import (
+    OrderCursorPagination, ProductCursorPagination, ProductPageNumberPagination
+)
+from main.progress import get_progress
+from main.renderers import EventStreamRenderer, format_event
+from main.search import search_products
 from main.serializers import (
     PricelistUploadSerializer,
+    PricelistUploadSessionSerializer,
+    ProductCompactSerializer,
     ProductDetailSerializer,
     ProductListSerializer,
     SellerOrderDetailSerializer,
@@ -19,8 +44,16 @@ from main.serializers import (
     BuyerOrderDetailSerializer,
     BuyerOrderListSerializer,
 )
-from main.tasks import send_order_emails
-from users.permissions import IsSeller, IsBuyer, OrderPermission
+from main.tasks import parse_pricelist, refresh_offer_summary, send_order_emails
+from main.utils import annotate_totals
+from users.permissions import IsAdmin, IsSeller, IsBuyer, OrderPermission
+
+# Параметры выбора полей ответа (SparseFieldsMixin)
+SPARSE_FIELDS_PARAMETERS = [
+    OpenApiParameter('fields', OpenApiTypes.STR, description='Поля ответа через запятую'),
+    OpenApiParameter('expand', OpenApiTypes.STR,
+                     description='Вложенные объекты через запятую (пустое значение - без них)'),
+]
 
 
 class PricelistUploadViewSet(viewsets.GenericViewSet,
@@ -30,6 +63,10 @@ class PricelistUploadViewSet(viewsets.GenericViewSet,
     serializer_class = PricelistUploadSerializer
     permission_classes = [IsAuthenticated, IsSeller]
     throttle_scope = 'upload'
+    # Наибольшая длительность потока событий, секунд, и количество опросов подряд
+    # без прогресса импорта, после которых поток завершается событием `timeout`
+    events_timeout = 60 * 60
+    events_max_idle_polls = 30
     
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -42,6 +79,18 @@ class PricelistUploadViewSet(viewsets.GenericViewSet,
         
         Категория,Бренд,Модель,Артикул,Количество,Цена товара,Цена доставки,
         (Название характеристики,Значение характеристики)...
+
+        Также принимаются CSV, сжатый gzip (.csv.gz), JSON Lines (.jsonl, .jsonl.gz) -
+        по объекту на строку с полями category, brand, model, sku, in_stock,
+        product_price, delivery_price и props ({"Характеристика": "Значение"}) -
+        и Parquet (.parquet, без сжатия gzip) с теми же столбцами, остальные столбцы
+        считаются характеристиками.
+
+        Перед импортом проверяется весь файл, при ошибках в базу ничего не записывается.
+        Режим импорта (import_mode): `chunk` - параллельно, порциями в отдельных
+        транзакциях, `file` - весь файл в одной транзакции.
+        При replace_props=true набор характеристик товара заменяется характеристиками
+        из файла, иначе - дополняется ими.
         """
         return super().create(request, *args, **kwargs)
         
@@ -50,32 +99,344 @@ class PricelistUploadViewSet(viewsets.GenericViewSet,
         serializer.save(seller=self.request.user)
 
     @extend_schema(summary='Просмотр результата выгрузки прайс-листа')
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Пока прайс-лист импортируется, в поле progress - этап импорта, количество
+        обработанных строк, скорость (строк/с) и оценка оставшегося времени (с).
+        """
+        return super().retrieve(request, *args, **kwargs)
+
+    @extend_schema(
+        summary='Поток прогресса импорта прайс-листа (Server-Sent Events)',
+        responses={(200, 'text/event-stream'): OpenApiTypes.STR}
+    )
+    @action(methods=['GET'], detail=True, url_path='events',
+            renderer_classes=[EventStreamRenderer, JSONRenderer])
+    def events(self, request, pk=None):
+        """
+        Раз в секунду отправляется событие `progress` (как поле progress),
+        по окончании импорта - событие `result` с итоговым upload_result.
+        Если импорт не закончился за час или прогресс не обновляется (задача
+        не выполняется), поток завершается событием `timeout` с текущим upload_result.
+        """
+        instance = self.get_object()
+        response = StreamingHttpResponse(
+            self._event_stream(instance), content_type=EventStreamRenderer.media_type)
+        response['Cache-Control'] = 'no-cache'
+        # Отключение буферизации ответа в nginx
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def _event_stream(self, instance):
+        deadline = time.monotonic() + self.events_timeout
+        idle_polls = 0
+        while True:
+            instance.refresh_from_db(fields=['upload_result'])
+            if instance.upload_result.get('status') != 'parsing':
+                yield format_event('result', instance.upload_result)
+                return
+            progress = get_progress(instance.id)
+            idle_polls = idle_polls + 1 if progress is None else 0
+            if idle_polls >= self.events_max_idle_polls or time.monotonic() >= deadline:
+                yield format_event('timeout', instance.upload_result)
+                return
+            yield format_event('progress', progress)
+            time.sleep(1)
+    
+    
+class PricelistUploadSessionViewSet(viewsets.GenericViewSet,
+                                    mixins.CreateModelMixin,
+                                    mixins.RetrieveModelMixin,
+                                    mixins.DestroyModelMixin):
+    queryset = PricelistUploadSession.objects.all()
+    serializer_class = PricelistUploadSessionSerializer
+    permission_classes = [IsAuthenticated, IsSeller]
+    throttle_scope = 'upload_chunks'
+    # Размер блока, которым тело запроса переписывается в файл
+    block_size = 64 * 1024
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # Просроченные незавершённые загрузки недоступны до удаления cleanup_upload_sessions
+        return queryset.filter(seller=self.request.user).exclude(
+            pricelist_file__isnull=True,
+            updated_at__lt=PricelistUploadSession.expires_before())
+    
+    def get_throttles(self):
+        # Открытие сессии - это новая выгрузка прайс-листа, лимит как у обычной выгрузки
+        if self.action == 'create':
+            self.throttle_scope = 'upload'
+        return super().get_throttles()
+    
+    @extend_schema(summary='Начало загрузки прайс-листа частями')
+    def create(self, request, *args, **kwargs):
+        """
+        Загрузка больших прайс-листов частями:
+        
+        1. POST /upload-sessions/ - открытие сессии (имя файла, необязательный размер).
+        2. PUT /upload-sessions/{id}/chunk/ - части файла телом запроса
+           (application/octet-stream) с заголовком Upload-Offset - смещением части в файле.
+        3. POST /upload-sessions/{id}/commit/ - завершение загрузки и постановка
+           прайс-листа в очередь на импорт.
+        
+        После обрыва соединения загрузка продолжается с последнего подтверждённого
+        байта - поля offset из GET /upload-sessions/{id}/. Незавершённая загрузка
+        удаляется через UPLOAD_SESSION_MAX_AGE секунд после последней принятой части.
+        """
+        return super().create(request, *args, **kwargs)
+    
+    def perform_create(self, serializer):
+        serializer.save(seller=self.request.user)
+    
+    @extend_schema(summary='Состояние загрузки прайс-листа частями')
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
     
+    @extend_schema(summary='Отмена загрузки прайс-листа частями')
+    def destroy(self, request, *args, **kwargs):
+        return super().destroy(request, *args, **kwargs)
+    
+    def perform_destroy(self, instance):
+        if not instance.pricelist_file_id:
+            instance.file.delete(save=False)
+        instance.delete()
     
-class ProductViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Variant.objects.prefetch_related('product', 'pricelist')
+    @extend_schema(
+        summary='Загрузка части прайс-листа',
+        request={'application/octet-stream': OpenApiTypes.BINARY},
+        parameters=[
+            OpenApiParameter(
+                'Upload-Offset', OpenApiTypes.INT, OpenApiParameter.HEADER, required=True,
+                description='Смещение части в файле (равно offset сессии)')
+        ],
+        responses={200: PricelistUploadSessionSerializer}
+    )
+    @action(methods=['PUT'], detail=True, url_path='chunk')
+    def chunk(self, request, pk=None):
+        """
+        Тело запроса дописывается в файл блоками, без буферизации в памяти.
+        При несовпадении Upload-Offset с offset сессии возвращается 409 и текущий offset.
+        """
+        session = self.get_object()
+        offset = request.headers.get('Upload-Offset', '')
+        with transaction.atomic():
+            session = PricelistUploadSession.objects.select_for_update().get(pk=session.pk)
+            if session.pricelist_file_id:
+                raise ValidationError({'error': 'upload already committed'})
+            if not offset.isdigit() or int(offset) != session.offset:
+                return Response(
+                    {'error': 'Upload-Offset does not match', 'offset': session.offset},
+                    status=409)
+            stream = request.stream
+            with open(session.file.path, 'r+b') as f:
+                # Байты оборванной части, не подтверждённые в offset, отбрасываются
+                f.truncate(session.offset)
+                f.seek(session.offset)
+                while stream and (block := stream.read(self.block_size)):
+                    f.write(block)
+                    if session.size is not None and f.tell() > session.size:
+                        raise ValidationError({'error': 'chunk exceeds declared file size'})
+                session.offset = f.tell()
+            session.save(update_fields=['offset', 'updated_at'])
+        return Response(self.get_serializer(session).data)
+    
+    @extend_schema(summary='Завершение загрузки прайс-листа частями',
+                   request=None, responses={201: PricelistUploadSerializer})
+    @action(methods=['POST'], detail=True, url_path='commit')
+    def commit(self, request, pk=None):
+        """
+        Загруженный файл без копирования становится прайс-листом и ставится в очередь
+        на импорт. Результат импорта - по ссылке result_check_endpoint.
+        """
+        session = self.get_object()
+        with transaction.atomic():
+            session = PricelistUploadSession.objects.select_for_update().get(pk=session.pk)
+            if session.pricelist_file_id:
+                raise ValidationError({'error': 'upload already committed'})
+            if not session.offset:
+                raise ValidationError({'error': 'file is empty'})
+            if session.size is not None and session.offset != session.size:
+                raise ValidationError({
+                    'error': 'upload is incomplete',
+                    'offset': session.offset,
+                    'size': session.size
+                })
+            pricelist_file = PricelistFile.objects.create(
+                seller=session.seller,
+                file=session.file.name,
+                import_mode=session.import_mode,
+                replace_props=session.replace_props,
+                upload_result={'status': 'parsing'})
+            session.pricelist_file = pricelist_file
+            session.save(update_fields=['pricelist_file'])
+        parse_pricelist.delay(pricelist_file.id)
+        serializer = PricelistUploadSerializer(
+            pricelist_file, context=self.get_serializer_context())
+        return Response(serializer.data, status=201)
+
+
+def order_items_queryset():
+    """Позиции заказа со всеми данными для вывода - одним запросом"""
+    return OrderItem.objects.select_related(
+        'pricelist__variant__product__brand', 'pricelist__seller').order_by('id')
+
+
+class RequestedFieldsMixin:
+    def get_requested_fields(self):
+        # Поля ответа с учётом ?fields= и ?expand= - по ним строится queryset
+        if not hasattr(self, '_requested_fields'):
+            self._requested_fields = tuple(self.get_serializer().fields)
+        return self._requested_fields
+
+
+class ProductViewSet(RequestedFieldsMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Variant.objects.defer('search_vector')
+    # Связанные записи для полей ответа
+    related_fields = {
+        'brand': 'product__brand', 'title': 'product', 'category': 'product__category'
+    }
+    pagination_class = ProductCursorPagination
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    lookup_value_regex = r'\d+'
+    
+    def is_ranked_search(self):
+        # Результаты поиска без явного ordering сортируются по релевантности
+        params = self.request.query_params
+        return bool(params.get('search')) and not params.get('ordering')
+    
+    def is_compact(self):
+        # Компактный список - сводка предложений вместо вложенного списка цен
+        return self.action == 'list' and \
+            self.request.query_params.get('compact', '').lower() in ('1', 'true')
+    
+    @property
+    def paginator(self):
+        # По умолчанию - keyset-пагинация (?cursor=), при ?page= и при сортировке
+        # по релевантности - по номеру страницы
+        if not hasattr(self, '_paginator'):
+            if 'page' in self.request.query_params or self.is_ranked_search():
+                self._paginator = ProductPageNumberPagination()
+            else:
+                self._paginator = self.pagination_class()
+                self._paginator.ordering = get_product_ordering(self.request.query_params)
+        return self._paginator
+    
+    def get_queryset(self):
+        # Количество запросов не зависит от количества товаров и предложений продавцов,
+        # связанные записи читаются только для запрошенных полей
+        fields = self.get_requested_fields()
+        queryset = super().get_queryset().select_related(*sorted({
+            self.related_fields[name] for name in fields if name in self.related_fields
+        }))
+        if 'prices' in fields:
+            queryset = queryset.prefetch_related(
+                Prefetch('prices', queryset=Pricelist.objects.select_related(
+                    'seller').order_by('id')))
+        if 'props' in fields:
+            queryset = queryset.prefetch_related('props')
+        if self.action == 'list':
+            params = self.request.query_params
+            queryset = filter_products(queryset, params)
+            if params.get('search'):
+                queryset = search_products(queryset, params['search'])
+            if not self.is_ranked_search():
+                queryset = order_products(queryset, get_product_ordering(params))
+        return queryset
     
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return ProductDetailSerializer
+        if self.is_compact():
+            return ProductCompactSerializer
         return ProductListSerializer
 
-    @extend_schema(summary='Просмотр списка товаров')
+    @extend_schema(
+        summary='Просмотр списка товаров',
+        parameters=[
+            OpenApiParameter('category', OpenApiTypes.STR, many=True,
+                             description='Название категории'),
+            OpenApiParameter('brand', OpenApiTypes.STR, many=True,
+                             description='Название бренда'),
+            OpenApiParameter('seller', OpenApiTypes.INT, description='id продавца'),
+            OpenApiParameter('min_price', OpenApiTypes.INT, description='Цена от'),
+            OpenApiParameter('max_price', OpenApiTypes.INT, description='Цена до'),
+            OpenApiParameter('in_stock', OpenApiTypes.BOOL, description='Только в наличии'),
+            OpenApiParameter('prop', OpenApiTypes.STR, many=True,
+                             description='Характеристика в формате `Название:Значение`'),
+            OpenApiParameter('search', OpenApiTypes.STR,
+                             description='Поиск по бренду, модели, артикулу и характеристикам'),
+            OpenApiParameter('ordering', OpenApiTypes.STR, enum=PRODUCT_ORDERINGS,
+                             description='Сортировка'),
+            OpenApiParameter('compact', OpenApiTypes.BOOL,
+                             description='Сводка предложений без списка цен'),
+            *SPARSE_FIELDS_PARAMETERS,
+        ]
+    )
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        """
+        Список разбит на страницы по полям сортировки: ссылки на соседние страницы - в полях
+        next/previous (параметр cursor). Размер страницы - параметр page_size
+        (по умолчанию 50, не более 500). Параметр page переключает на навигацию
+        по номеру страницы.
+        
+        Условия на цену, наличие и продавца относятся к одному предложению продавца.
+        
+        Результаты поиска (параметр search) без параметра ordering сортируются
+        по релевантности и разбиты на страницы по номеру.
+        
+        Сортировка по min_price/min_landed_price выводит только товары, которые
+        есть в наличии хотя бы у одного продавца. При compact=true вместо списка
+        цен продавцов выводится сводка: минимальная цена, минимальная цена
+        с доставкой, количество предложений и общий остаток.
+        
+        Параметр fields ограничивает поля ответа (например, fields=id,sku,title),
+        expand - вложенные объекты (expand= - без списка цен). Не запрошенные
+        связанные записи не читаются из базы.
+        
+        Ответ кэшируется до импорта прайс-листа, изменившего цены; поддерживается
+        заголовок If-None-Match (ответ 304 при совпадении ETag).
+        """
+        if settings.FAST_SERIALIZATION:
+            build = partial(self.fast_list, request)
+        else:
+            build = partial(super().list, request, *args, **kwargs)
+        return catalog_cache.cached_response(request, catalog_cache.list_key(request), build)
+    
+    def fast_list(self, request):
+        # Записи страницы читаются через values() и собираются по описанию полей
+        # сериализатора, без вызова полей DRF на каждую запись
+        serializer = get_values_serializer(
+            self.get_serializer_class(), self.get_requested_fields())
+        # Поля сортировки нужны keyset-пагинации для ссылки на следующую страницу
+        ordering = [field.lstrip('-') for field in getattr(self.paginator, 'ordering', ())]
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(serializer.values(queryset, *ordering))
+        return self.get_paginated_response(serializer.serialize(page))
 
-    @extend_schema(summary='Просмотр информации о товаре')
+    @extend_schema(summary='Просмотр информации о товаре', parameters=SPARSE_FIELDS_PARAMETERS)
     def retrieve(self, request, *args, **kwargs):
-        return super().retrieve(request, *args, **kwargs)
+        """
+        Ответ кэшируется до импорта прайс-листа, изменившего цены модификации;
+        поддерживается заголовок If-None-Match.
+        """
+        return catalog_cache.cached_response(
+            request, catalog_cache.detail_key(int(kwargs['pk']), self.get_requested_fields()),
+            lambda: super(ProductViewSet, self).retrieve(request, *args, **kwargs))
+    
+    @extend_schema(summary='Статистика кэша каталога', responses=OpenApiTypes.OBJECT)
+    @action(detail=False, url_path='cache-stats', permission_classes=[IsAdmin])
+    def cache_stats(self, request):
+        """Попадания и промахи кэша, ответы 304 и количество инвалидаций"""
+        return Response(catalog_cache.get_stats())
     
 
-class OrderViewSet(viewsets.GenericViewSet,
+class OrderViewSet(RequestedFieldsMixin,
+                   viewsets.GenericViewSet,
                    mixins.ListModelMixin,
                    mixins.RetrieveModelMixin):
     permission_classes = [OrderPermission]
     queryset = Order.objects.all()
+    pagination_class = OrderCursorPagination
     
     def get_serializer_class(self):
         if self.request.user.role == 'seller':
@@ -90,12 +451,45 @@ class OrderViewSet(viewsets.GenericViewSet,
         queryset = super().get_queryset()
         user = self.request.user
         if user.role == 'buyer':
-            return queryset.filter(customer=user).exclude(status='in_cart')
+            queryset = queryset.filter(customer=user).exclude(status='in_cart')
+            seller = None
         else:
-            return queryset.exclude(status='in_cart').filter(items__seller=user).distinct()
+            # EXISTS вместо соединения с позициями и DISTINCT: строки заказов
+            # не размножаются, и суммы ниже считаются по одной группе на заказ
+            queryset = queryset.exclude(status='in_cart').filter(Exists(
+                OrderItem.objects.filter(order=OuterRef('pk'), pricelist__seller=user)))
+            seller = user
+        if self.action == 'list':
+            queryset = filter_orders(queryset, self.request.query_params)
+        fields = self.get_requested_fields()
+        if 'customer' in fields or 'customer_company' in fields:
+            queryset = queryset.select_related('customer')
+        # Суммы заказов считаются в том же запросе, что и список
+        if 'summary' in fields:
+            queryset = annotate_totals(queryset, seller)
+        # Позиции заказов (продавцу - только его) со всеми данными для вывода
+        # читаются одним запросом на страницу
+        if 'items' in fields:
+            items = order_items_queryset()
+            if seller is not None:
+                items = Prefetch('order_items', queryset=items.filter(pricelist__seller=seller),
+                                 to_attr='visible_items')
+            else:
+                items = Prefetch('order_items', queryset=items)
+            queryset = queryset.prefetch_related(items)
+        return queryset
     
     @extend_schema(
         operation_id='orders-list',
+        parameters=[
+            OpenApiParameter('status', OpenApiTypes.STR, enum=ORDER_STATUSES, many=True,
+                             description='Статус заказа (можно указать несколько)'),
+            OpenApiParameter('created_after', OpenApiTypes.DATETIME,
+                             description='Оформлен не раньше (дата или дата и время)'),
+            OpenApiParameter('created_before', OpenApiTypes.DATETIME,
+                             description='Оформлен раньше (дата или дата и время)'),
+            *SPARSE_FIELDS_PARAMETERS
+        ],
         responses=BuyerOrderListSerializer,
         examples=[
             OpenApiExample(
@@ -115,13 +509,14 @@ class OrderViewSet(viewsets.GenericViewSet,
     )
     def list(self, request, *args, **kwargs):
         """
-        Выдача зависит от роли пользователя
+        Выдача зависит от роли пользователя. Заказы выдаются постранично, новые первыми:
+        ссылки на соседние страницы - в полях next и previous.
         """
         return super().list(request, *args, **kwargs)
     
     @extend_schema(
         summary='Детальная информация о заказе',
-        parameters=None,
+        parameters=SPARSE_FIELDS_PARAMETERS,
         request=None,
         responses=[BuyerOrderDetailSerializer, SellerOrderDetailSerializer],
         examples=[
@@ -152,6 +547,8 @@ class CartViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, IsBuyer]
     serializer_class = CartSerializer
     http_method_names = ['get', 'post', 'delete']
+    # Попыток оформления при взаимоблокировке или конфликте сериализации
+    checkout_attempts = 3
     
     # фильтр: только своя неотправленная в заказ корзина
     def get_queryset(self):
@@ -193,28 +590,21 @@ class CartViewSet(viewsets.ModelViewSet):
         ]
     )
     def create(self, request, *args, **kwargs):
-        # Получаем корзину если есть либо создаём пустую
-        cart, _ = Order.objects.get_or_create(
-            customer=request.user, status='in_cart')
-        # Если корзина пуста - наполняем товарами из запроса
-        if not cart.items.all():
-            items = request.data.pop('items')
-            serializer = OrderItemSerializer(data=items, many=True)
-            serializer.is_valid(raise_exception=True)
-            for item in serializer.validated_data:
-                OrderItem.objects.create(
-                    order=cart,
-                    pricelist=item['pricelist'],
-                    quantity=item['quantity'])
-        # Если в корзине товары - удаляем и наполняем товарами из запроса
-        else:
-            items = request.data.pop('items')
+        """
+        Содержимое корзины заменяется позициями из запроса. Позиции проверяются
+        до изменения корзины, замена - одним удалением и одной вставкой.
+        """
+        serializer = OrderItemSerializer(data=request.data.get('items'), many=True)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            # Получаем корзину если есть либо создаём пустую
+            cart, _ = Order.objects.get_or_create(
+                customer=request.user, status='in_cart')
             cart.order_items.all().delete()
-            serializer = OrderItemSerializer(data=items, many=True)
-            serializer.is_valid(raise_exception=True)
-            new_items = serializer.create(serializer.validated_data)
-            cart.order_items.set(new_items)
-        cart.refresh_from_db()
+            OrderItem.objects.bulk_create([
+                OrderItem(order=cart, **item) for item in serializer.validated_data])
+        cart = Order.objects.prefetch_related(
+            Prefetch('order_items', queryset=order_items_queryset())).get(pk=cart.pk)
         return Response(self.serializer_class(cart).data, status=201)
     
     # При создании корзины прописываем её владельца
@@ -251,28 +641,48 @@ class CartViewSet(viewsets.ModelViewSet):
     def cart_checkout(self, request):
         """
         Для отправки заказа обязательно указать адрес доставки (поле address).
+        Остатки предложений проверяются и списываются в транзакции оформления.
         """
-        cart = request.user.orders.filter(status='in_cart').first()
-        if cart:
-            items = cart.order_items.all()
-            for item in items:
-                if item.quantity > item.pricelist.in_stock:
-                    raise ValidationError({
-                        'pricelist_id': item.pricelist.id,
-                        'product': item.pricelist.variant,
-                        'in_stock': item.pricelist.in_stock
-                    })
+        for _ in range(self.checkout_attempts):
+            try:
+                return self._checkout(request)
+            except OperationalError as exc:
+                # Взаимоблокировка или конфликт сериализации - транзакция повторяется
+                if not is_retryable(exc):
+                    raise
+        return Response({'error': 'checkout conflict, try again'}, status=409)
+    
+    def _checkout(self, request):
+        with transaction.atomic():
+            # Блокировка корзины: повторное оформление той же корзины ждёт
+            # завершения первого и корзины уже не находит
+            cart = request.user.orders.select_for_update().filter(status='in_cart').first()
+            if not cart:
+                raise ValidationError({'error': 'cart is empty'})
             if 'address' not in request.data:
                 return Response({'error': 'field `address` required for order processing'})
             if request.data['address'] == '':
                 return Response({'error': 'field `address` cannot be blank'})
+            try:
+                variant_ids = reserve_stock(cart.id)
+            except OutOfStock as exc:
+                pricelist = Pricelist.objects.select_related(
+                    'variant__product__brand').get(pk=exc.pricelist_id)
+                raise ValidationError({
+                    'pricelist_id': pricelist.id,
+                    'product': pricelist.variant,
+                    'in_stock': exc.in_stock
+                })
+            if not variant_ids:
+                raise ValidationError({'error': 'cart is empty'})
             cart.address = request.data['address']
             cart.status = 'accepted'
             cart.created_at = timezone.now()
-            cart.save()
-            send_order_emails.delay(cart.id)
-        else:
-            raise ValidationError({'error': 'cart is empty'})
+            cart.save(update_fields=['address', 'status', 'created_at'])
+            transaction.on_commit(partial(send_order_emails.delay, cart.id))
+            transaction.on_commit(partial(refresh_offer_summary.delay, sorted(variant_ids)))
+        cart = Order.objects.prefetch_related(
+            Prefetch('order_items', queryset=order_items_queryset())).get(pk=cart.pk)
         return Response(BuyerOrderDetailSerializer(cart).data)
     
     # Исключение методов из swagger
@@ -1,10 +1,20 @@
 import os
 
 import pytest
+from django.core.cache import cache
+from django.core.files.base import ContentFile
 from model_bakery import baker
 from rest_framework.test import APIClient
 
-from main.models import Variant, Pricelist
+from main.models import Variant, Pricelist, PricelistFile
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Счётчики throttling и прогресс импорта хранятся в общем кэше (Redis)"""
+    cache.clear()
+    yield
+    cache.clear()
 
 
 @pytest.fixture
@@ -62,6 +72,19 @@ def csv_pricelist():
     os.remove('test_price.csv')
 
 
+@pytest.fixture
+def pricelist_file_factory(settings, tmp_path):
+    """Фикстура для создания выгруженных прайс-листов с содержимым `content` (bytes)"""
+    settings.MEDIA_ROOT = tmp_path
+    
+    def factory(seller, content, name='pricelist.csv', **kwargs):
+        return PricelistFile.objects.create(
+            seller=seller, file=ContentFile(content, name=name),
+            upload_result={'status': 'parsing'}, **kwargs)
+    
+    return factory
+
+
 @pytest.fixture
 def product_factory():
     def factory(**kwargs):
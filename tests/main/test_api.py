@@ -1,10 +1,27 @@
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
 import pytest
+from django.core.cache import cache
+from django.db import OperationalError, connection
 from django.urls import reverse
+from django.utils import timezone
+from model_bakery import baker
+from psycopg2.errors import DeadlockDetected
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
 
-from main.models import PricelistFile
+from config.django_celery import app
+from main import catalog_cache, offers, progress
+from main.models import (
+    Order, OrderItem, Pricelist, PricelistFile, PricelistUploadSession, Variant
+)
+from main.offers import update_offer_summary
+from main.search import update_search_vectors
+from main.tasks import cleanup_upload_sessions
+from users.permissions import OrderPermission
 
 
 @pytest.mark.django_db
@@ -31,14 +48,305 @@ class TestMain:
         assert response.status_code == status_code
         assert PricelistFile.objects.count() == pricelist_count_before + count
     
+    @pytest.mark.parametrize('file_name, status_code', [
+        ('pricelist.csv.gz', 201),
+        ('pricelist.parquet.gz', 400),
+        ('pricelist.txt', 400),
+    ])
+    def test_upload_session_file_name(self, api_client, user_factory, settings, tmp_path,
+                                      file_name, status_code):
+        """Сжатие gzip допускается только для текстовых форматов"""
+        settings.MEDIA_ROOT = tmp_path
+        api_client.force_authenticate(user_factory(role='seller'))
+        response = api_client.post(reverse('upload-sessions-list'), {'file_name': file_name})
+        assert response.status_code == status_code
+    
+    def test_upload_progress(self, api_client, user_factory):
+        user = user_factory(role='seller')
+        file = baker.make(PricelistFile, seller=user, upload_result={'status': 'parsing'})
+        progress.start_phase(file.id, 'importing', 100)
+        progress.advance(file.id, 40)
+        url = reverse('upload-detail', kwargs={'pk': file.id})
+        api_client.force_authenticate(user)
+        response = api_client.get(url)
+        assert response.status_code == 200
+        assert response.json()['progress']['phase'] == 'importing'
+        assert response.json()['progress']['rows_processed'] == 40
+        assert response.json()['progress']['rows_total'] == 100
+    
+    def test_upload_events_timeout(self, api_client, user_factory, monkeypatch):
+        """Поток событий завершается, если прогресс импорта не обновляется"""
+        monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+        user = user_factory(role='seller')
+        file = baker.make(PricelistFile, seller=user, upload_result={'status': 'parsing'})
+        url = reverse('upload-events', kwargs={'pk': file.id})
+        api_client.force_authenticate(user)
+        response = api_client.get(url, HTTP_ACCEPT='text/event-stream')
+        events = b''.join(response.streaming_content).decode().split('\n\n')
+        assert events[:-2] == ['event: progress\ndata: null'] * 29
+        assert events[-2].startswith('event: timeout')
+    
+    def test_upload_session(self, api_client, user_factory, settings, tmp_path, monkeypatch):
+        """Загрузка частями: несовпадающее смещение, продолжение после обрыва и завершение"""
+        settings.MEDIA_ROOT = tmp_path
+        queued = []
+        monkeypatch.setattr('main.views.parse_pricelist.delay', queued.append)
+        user = user_factory(role='seller')
+        api_client.force_authenticate(user)
+        content = b'0123456789' * 10
+        response = api_client.post(
+            reverse('upload-sessions-list'), {'file_name': 'pricelist.csv', 'size': 100})
+        assert response.status_code == 201
+        session_id = response.json()['id']
+        chunk_url = reverse('upload-sessions-chunk', kwargs={'pk': session_id})
+        
+        response = api_client.put(chunk_url, content[:40], content_type='application/octet-stream',
+                                  HTTP_UPLOAD_OFFSET='0')
+        assert response.status_code == 200
+        assert response.json()['offset'] == 40
+        # Повтор уже принятой части отклоняется с текущим смещением
+        response = api_client.put(chunk_url, content[:40], content_type='application/octet-stream',
+                                  HTTP_UPLOAD_OFFSET='0')
+        assert response.status_code == 409
+        assert response.json()['offset'] == 40
+        
+        # Незавершённая загрузка не ставится в очередь
+        commit_url = reverse('upload-sessions-commit', kwargs={'pk': session_id})
+        response = api_client.post(commit_url)
+        assert response.status_code == 400
+        assert response.json()['error'] == 'upload is incomplete'
+        
+        # Продолжение с подтверждённого смещения
+        response = api_client.get(reverse('upload-sessions-detail', kwargs={'pk': session_id}))
+        offset = response.json()['offset']
+        response = api_client.put(chunk_url, content[offset:],
+                                  content_type='application/octet-stream',
+                                  HTTP_UPLOAD_OFFSET=str(offset))
+        assert response.status_code == 200
+        assert response.json()['offset'] == 100
+        
+        response = api_client.post(commit_url)
+        assert response.status_code == 201
+        pricelist_file = PricelistUploadSession.objects.get(pk=session_id).pricelist_file
+        assert queued == [pricelist_file.id]
+        assert pricelist_file.file.read() == content
+        response = api_client.put(chunk_url, b'1', content_type='application/octet-stream',
+                                  HTTP_UPLOAD_OFFSET='100')
+        assert response.status_code == 400
+    
+    def test_upload_session_oversize(self, api_client, user_factory, settings, tmp_path):
+        """Часть, выходящая за объявленный размер файла, отклоняется"""
+        settings.MEDIA_ROOT = tmp_path
+        user = user_factory(role='seller')
+        api_client.force_authenticate(user)
+        response = api_client.post(
+            reverse('upload-sessions-list'), {'file_name': 'pricelist.csv', 'size': 10})
+        session_id = response.json()['id']
+        chunk_url = reverse('upload-sessions-chunk', kwargs={'pk': session_id})
+        response = api_client.put(chunk_url, b'x' * 11, content_type='application/octet-stream',
+                                  HTTP_UPLOAD_OFFSET='0')
+        assert response.status_code == 400
+        assert PricelistUploadSession.objects.get(pk=session_id).offset == 0
+        response = api_client.post(reverse('upload-sessions-commit', kwargs={'pk': session_id}))
+        assert response.status_code == 400
+    
+    def test_cleanup_upload_sessions(self, api_client, user_factory, settings, tmp_path):
+        """Брошенные загрузки удаляются вместе с файлами, завершённые и активные остаются"""
+        settings.MEDIA_ROOT = tmp_path
+        user = user_factory(role='seller')
+        api_client.force_authenticate(user)
+        sessions = []
+        for _ in range(3):
+            response = api_client.post(
+                reverse('upload-sessions-list'), {'file_name': 'pricelist.csv'})
+            sessions.append(PricelistUploadSession.objects.get(pk=response.json()['id']))
+            cache.clear()
+        stale, committed, active = sessions
+        committed.pricelist_file = baker.make(
+            PricelistFile, seller=user, file=committed.file.name, upload_result={})
+        committed.save()
+        expired = timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_MAX_AGE + 1)
+        PricelistUploadSession.objects.update(created_at=expired, updated_at=expired)
+        # Срок отсчитывается от последней части: долгая загрузка с новыми частями остаётся
+        PricelistUploadSession.objects.filter(pk=active.pk).update(
+            updated_at=timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_MAX_AGE - 60))
+        response = api_client.put(
+            reverse('upload-sessions-chunk', kwargs={'pk': active.pk}), b'data',
+            content_type='application/octet-stream', HTTP_UPLOAD_OFFSET='0')
+        assert response.status_code == 200
+        active.refresh_from_db()
+        assert active.updated_at > timezone.now() - timedelta(seconds=60)
+        
+        response = api_client.get(reverse('upload-sessions-detail', kwargs={'pk': stale.pk}))
+        assert response.status_code == 404
+        cleanup_upload_sessions()
+        assert set(PricelistUploadSession.objects.values_list('pk', flat=True)) == {
+            committed.pk, active.pk}
+        assert not os.path.exists(stale.file.path)
+        assert os.path.exists(committed.file.path)
+        assert os.path.exists(active.file.path)
+    
     def test_product_list(self, api_client, product_factory):
         product_qty = 5
         products = product_factory(_quantity=product_qty, in_stock=1)
         url = reverse('products-list')
         response = api_client.get(url)
         assert response.status_code == 200
-        assert isinstance(response.json(), list)
-        assert len(response.json()) == len(products)
+        assert isinstance(response.json()['results'], list)
+        assert len(response.json()['results']) == len(products)
+    
+    def test_product_list_cursor_pagination(self, api_client, product_factory):
+        products = product_factory(_quantity=5, in_stock=1)
+        url = reverse('products-list')
+        response = api_client.get(url, {'page_size': 2})
+        ids = [item['id'] for item in response.json()['results']]
+        while response.json()['next']:
+            response = api_client.get(response.json()['next'])
+            ids += [item['id'] for item in response.json()['results']]
+        assert ids == sorted(product.id for product in products)
+    
+    @pytest.mark.parametrize('ordering', ['min_price', '-min_price'])
+    def test_product_list_cursor_pagination_ties(self, api_client, ordering):
+        """Страницы по цене проходят все модификации с одинаковой ценой (больше offset_cutoff)"""
+        product = baker.make('main.Product')
+        variants = Variant.objects.bulk_create([
+            Variant(product=product, sku=f'sku-{ix}', min_price=100 if ix else 50,
+                    min_landed_price=110)
+            for ix in range(1200)
+        ])
+        ids = sorted(variant.id for variant in variants)
+        expected = [ids[0], *ids[1:]] if ordering == 'min_price' else [*ids[:0:-1], ids[0]]
+        url = reverse('products-list')
+        response = api_client.get(url, {'ordering': ordering, 'compact': 1, 'page_size': 100})
+        pages = [[item['id'] for item in response.json()['results']]]
+        while response.json()['next']:
+            response = api_client.get(response.json()['next'])
+            pages.append([item['id'] for item in response.json()['results']])
+        assert sum(pages, []) == expected
+        assert len(pages) == 12
+        # Ссылка previous возвращает предыдущую страницу
+        response = api_client.get(response.json()['previous'])
+        assert [item['id'] for item in response.json()['results']] == pages[-2]
+    
+    def test_product_list_filter(self, api_client, product_factory):
+        products = product_factory(_quantity=3, in_stock=1)
+        Pricelist.objects.filter(variant=products[0]).update(product_price=100)
+        Pricelist.objects.filter(variant=products[1]).update(product_price=200, in_stock=0)
+        url = reverse('products-list')
+        response = api_client.get(
+            url, {'min_price': 50, 'max_price': 300, 'in_stock': 'true', 'ordering': '-id'})
+        assert response.status_code == 200
+        assert [item['id'] for item in response.json()['results']] == [products[0].id]
+        response = api_client.get(url, {'ordering': 'price'})
+        assert response.status_code == 400
+    
+    def test_product_search(self, api_client, product_factory):
+        products = product_factory(_quantity=3, in_stock=1)
+        products[1].sku = 'SM-G981B-128'
+        products[1].save()
+        update_search_vectors([product.id for product in products])
+        url = reverse('products-list')
+        response = api_client.get(url, {'search': 'sm g981'})
+        assert response.status_code == 200
+        assert [item['id'] for item in response.json()['results']] == [products[1].id]
+    
+    def test_product_list_compact(self, api_client, product_factory):
+        products = product_factory(_quantity=3, in_stock=1)
+        for product, price in zip(products, [300, 100, 200]):
+            Pricelist.objects.filter(variant=product).update(product_price=price, delivery_price=10)
+        Pricelist.objects.filter(variant=products[2]).update(in_stock=0)
+        update_offer_summary([product.id for product in products])
+        url = reverse('products-list')
+        response = api_client.get(url, {'compact': 'true', 'ordering': 'min_price'})
+        assert response.status_code == 200
+        results = response.json()['results']
+        assert [item['id'] for item in results] == [products[1].id, products[0].id]
+        assert results[0]['min_landed_price'] == 110
+        assert results[0]['offers_count'] == 1
+        assert 'prices' not in results[0]
+    
+    @pytest.mark.parametrize('params', [{}, {'compact': 'true'}, {'page': 1, 'page_size': 2}])
+    def test_product_list_fast_serialization(self, api_client, product_factory, settings,
+                                             params):
+        """Быстрая сериализация списка даёт тот же ответ, что и сериализатор DRF"""
+        products = product_factory(_quantity=3, in_stock=1)
+        product_factory(_quantity=2, in_stock=1)
+        Pricelist.objects.create(variant=products[0], seller=baker.make('users.User'))
+        url = reverse('products-list')
+        settings.FAST_SERIALIZATION = False
+        expected = api_client.get(url, params).content
+        cache.clear()
+        settings.FAST_SERIALIZATION = True
+        assert api_client.get(url, params).content == expected
+    
+    @pytest.mark.parametrize('fast_serialization', [True, False])
+    def test_product_list_sparse_fields(self, api_client, product_factory, settings,
+                                        django_assert_num_queries, fast_serialization):
+        """Без списка цен в ответе цены не читаются: один запрос модификаций"""
+        settings.FAST_SERIALIZATION = fast_serialization
+        product_factory(_quantity=3, in_stock=1)
+        url = reverse('products-list')
+        with django_assert_num_queries(1):
+            response = api_client.get(url, {'fields': 'id,sku,title,prices', 'expand': ''})
+        assert list(response.json()['results'][0]) == ['id', 'sku', 'title']
+        response = api_client.get(url, {'fields': 'id,color'})
+        assert response.status_code == 400
+    
+    @pytest.mark.parametrize('product_qty', [1, 10])
+    def test_product_list_query_count(self, api_client, product_factory,
+                                      django_assert_num_queries, product_qty):
+        """Список товаров: запрос модификаций и запрос цен с продавцами"""
+        product_factory(_quantity=product_qty, in_stock=1)
+        url = reverse('products-list')
+        with django_assert_num_queries(2):
+            response = api_client.get(url, {'page_size': product_qty})
+        assert response.status_code == 200
+    
+    def test_product_retrieve_query_count(self, api_client, product_factory,
+                                          django_assert_num_queries):
+        product = product_factory(in_stock=1)
+        url = reverse('products-detail', kwargs={'pk': product.pk})
+        with django_assert_num_queries(3):
+            response = api_client.get(url)
+        assert response.status_code == 200
+    
+    def test_product_retrieve_cache(self, api_client, product_factory):
+        product, = product_factory(_quantity=1, in_stock=1)
+        url = reverse('products-detail', kwargs={'pk': product.pk})
+        response = api_client.get(url)
+        assert response['X-Cache'] == 'MISS'
+        etag = response['ETag']
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        assert response['X-Cache'] == 'HIT'
+        Pricelist.objects.filter(variant=product).update(product_price=12345)
+        catalog_cache.invalidate([product.id])
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+        # Набор полей ответа - часть ключа кэша
+        response = api_client.get(url, {'fields': 'id'})
+        assert response.json() == {'id': product.id}
+        response = api_client.get(url)
+        assert response['X-Cache'] == 'HIT'
+        assert 'prices' in response.json()
+    
+    @pytest.mark.parametrize('role, is_admin, status_code', [
+        (None, False, 401),
+        ('seller', False, 403),
+        ('buyer', True, 200),
+    ])
+    def test_product_cache_stats(self, api_client, user_factory, product_factory,
+                                 role, is_admin, status_code):
+        """Статистика кэша каталога доступна только администраторам"""
+        product, = product_factory(_quantity=1, in_stock=1)
+        api_client.get(reverse('products-detail', kwargs={'pk': product.pk}))
+        if role:
+            api_client.force_authenticate(user_factory(role=role, is_admin=is_admin))
+        response = api_client.get(reverse('products-cache-stats'))
+        assert response.status_code == status_code
+        if status_code == 200:
+            assert response.json()['misses'] == 1
     
     def test_product_retrieve(self, api_client, product_factory):
         product = product_factory(in_stock=1)
@@ -70,7 +378,200 @@ class TestMain:
         response = api_client.post(url, products_data(products, quantity=1))
         assert response.status_code == status_code
     
+    @pytest.mark.parametrize('item_qty', [1, 20])
+    def test_put_items_in_cart_query_count(self, api_client, user_factory, product_factory,
+                                           products_data, django_assert_num_queries,
+                                           item_qty):
+        """Корзина заменяется пакетом: число запросов не зависит от количества позиций"""
+        user = user_factory(role='buyer')
+        api_client.force_authenticate(user)
+        url = reverse('cart-list')
+        api_client.post(url, products_data(product_factory(_quantity=3, in_stock=5), quantity=1))
+        data = products_data(product_factory(_quantity=item_qty, in_stock=5), quantity=2)
+        with django_assert_num_queries(9):
+            response = api_client.post(url, data)
+        assert response.status_code == 201
+        assert [item['quantity'] for item in response.json()['items']] == [2] * item_qty
+        assert OrderItem.objects.filter(order__customer=user).count() == item_qty
     
-
+    def test_put_items_in_cart_stock(self, api_client, user_factory, product_factory,
+                                     products_data):
+        """Остаток проверяется для каждой позиции, корзина при ошибке не меняется"""
+        user = user_factory(role='buyer')
+        api_client.force_authenticate(user)
+        url = reverse('cart-list')
+        products = product_factory(_quantity=2, in_stock=5)
+        api_client.post(url, products_data(products, quantity=1))
+        Pricelist.objects.filter(variant=products[1]).update(in_stock=1)
+        response = api_client.post(url, products_data(products, quantity=3))
+        assert response.status_code == 400
+        assert response.json()[0] == {}
+        assert response.json()[1]['quantity']['in stock'] == '1'
+        assert OrderItem.objects.filter(order__customer=user, quantity=1).count() == 2
+    
+    def test_put_items_in_cart_stock_total(self, api_client, user_factory, product_factory,
+                                           products_data):
+        """С остатком сверяется сумма позиций одного предложения"""
+        user = user_factory(role='buyer')
+        api_client.force_authenticate(user)
+        url = reverse('cart-list')
+        products = product_factory(_quantity=1, in_stock=5)
+        data = products_data(products, quantity=3)
+        data['items'] *= 2
+        response = api_client.post(url, data)
+        assert response.status_code == 400
+        assert [error['quantity']['in stock'] for error in response.json()] == ['5', '5']
+        assert not OrderItem.objects.filter(order__customer=user).exists()
+    
+    def test_cart_checkout(self, api_client, user_factory, product_factory, products_data,
+                           django_capture_on_commit_callbacks, monkeypatch):
+        """Оформление списывает остатки, сводка предложений обновляется после фиксации"""
+        monkeypatch.setattr(app.conf, 'task_always_eager', True)
+        user = user_factory(role='buyer')
+        api_client.force_authenticate(user)
+        products = product_factory(_quantity=2, in_stock=3)
+        Pricelist.objects.update(product_price=100, delivery_price=10)
+        update_offer_summary([product.id for product in products])
+        api_client.post(reverse('cart-list'), products_data(products, quantity=2))
+        url = reverse('cart-cart-checkout')
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.post(url, {'address': 'address'})
+        assert response.status_code == 200
+        assert response.json()['status'] == 'accepted'
+        assert list(Pricelist.objects.values_list('in_stock', flat=True)) == [1, 1]
+        products[0].refresh_from_db()
+        assert products[0].total_stock == 1
+        # Остатка не хватает: заказ не оформляется, остатки не меняются
+        api_client.post(reverse('cart-list'), products_data(products[:1], quantity=1))
+        Pricelist.objects.filter(variant=products[0]).update(in_stock=0)
+        response = api_client.post(url, {'address': 'address'})
+        assert response.status_code == 400
+        assert response.json()['in_stock'] == '0'
+        assert Order.objects.filter(customer=user, status='in_cart').exists()
+    
+    def test_cart_checkout_retry(self, api_client, user_factory, product_factory,
+                                 products_data, monkeypatch):
+        """Оформление повторяется после взаимоблокировки"""
+        user = user_factory(role='buyer')
+        api_client.force_authenticate(user)
+        products = product_factory(_quantity=1, in_stock=3)
+        api_client.post(reverse('cart-list'), products_data(products, quantity=1))
+        attempts = []
+        
+        def reserve_stock(order_id):
+            attempts.append(order_id)
+            if len(attempts) == 1:
+                raise OperationalError('deadlock detected') from DeadlockDetected()
+            return offers.reserve_stock(order_id)
+        
+        monkeypatch.setattr('main.views.reserve_stock', reserve_stock)
+        response = api_client.post(reverse('cart-cart-checkout'), {'address': 'address'})
+        assert response.status_code == 200
+        assert len(attempts) == 2
+        assert Pricelist.objects.get().in_stock == 2
+    
+    @pytest.mark.django_db(transaction=True)
+    def test_cart_checkout_concurrent(self, user_factory, product_factory):
+        """Параллельные оформления не продают больше остатка"""
+        product, = product_factory(_quantity=1, in_stock=5)
+        pricelist = product.prices.first()
+        buyers = [user_factory(role='buyer') for _ in range(10)]
+        for buyer in buyers:
+            order = baker.make('main.Order', customer=buyer, status='in_cart')
+            OrderItem.objects.create(order=order, pricelist=pricelist, quantity=1)
+        url = reverse('cart-cart-checkout')
+        
+        def checkout(buyer):
+            client = APIClient()
+            client.force_authenticate(buyer)
+            try:
+                return client.post(url, {'address': 'address'}).status_code
+            finally:
+                connection.close()
+        
+        with ThreadPoolExecutor(max_workers=len(buyers)) as executor:
+            statuses = list(executor.map(checkout, buyers))
+        assert sorted(statuses) == [200] * 5 + [400] * 5
+        pricelist.refresh_from_db()
+        assert pricelist.in_stock == 0
+    
+    @pytest.mark.parametrize('order_qty', [1, 5])
+    def test_order_list_summary(self, api_client, user_factory, order_factory,
+                                django_assert_num_queries, order_qty):
+        """Суммы заказов считаются в запросе списка: число запросов не зависит от заказов"""
+        buyer = user_factory(role='buyer')
+        orders = order_factory(_quantity=order_qty, customer=buyer, status='accepted',
+                               created_at=timezone.now())
+        OrderItem.objects.update(quantity=2)
+        Pricelist.objects.update(product_price=100, delivery_price=10)
+        seller = orders[0].items.first().seller
+        seller.role = 'seller'
+        seller.save()
+        url = reverse('orders-list')
+        api_client.force_authenticate(buyer)
+        with django_assert_num_queries(1):
+            response = api_client.get(url)
+        assert len(response.json()['results']) == order_qty
+        assert response.json()['results'][0]['summary'] == {
+            'products_total': 1000, 'delivery_total': 100, 'total': 1100}
+        api_client.force_authenticate(seller)
+        with django_assert_num_queries(1):
+            response = api_client.get(url)
+        # У продавца одна позиция в каждом заказе
+        assert len(response.json()['results']) == order_qty
+        assert response.json()['results'][0]['summary'] == {
+            'products_total': 200, 'delivery_total': 20, 'total': 220}
+    
+    def test_order_list_pagination_filter(self, api_client, user_factory, order_factory):
+        buyer = user_factory(role='buyer')
+        now = timezone.now()
+        orders = [
+            order_factory(customer=buyer, status=status, created_at=now - timedelta(days=days))
+            for status, days in [('accepted', 3), ('sent', 2), ('accepted', 1), ('accepted', 0)]
+        ]
+        url = reverse('orders-list')
+        api_client.force_authenticate(buyer)
+        response = api_client.get(url, {
+            'status': 'accepted', 'created_after': (now - timedelta(days=3)).date().isoformat(),
+            'created_before': now.isoformat(), 'page_size': 1})
+        ids = [item['id'] for item in response.json()['results']]
+        while response.json()['next']:
+            response = api_client.get(response.json()['next'])
+            ids += [item['id'] for item in response.json()['results']]
+        assert ids == [orders[2].id, orders[0].id]
+        response = api_client.get(url, {'status': 'in_cart'})
+        assert response.status_code == 400
+        response = api_client.get(url, {'created_after': 'yesterday'})
+        assert response.status_code == 400
+    
+    @pytest.mark.parametrize('user_role', ['buyer', 'seller'])
+    def test_order_retrieve_query_count(self, api_client, user_factory, order_factory,
+                                        django_assert_max_num_queries, user_role):
+        """Позиции заказа со всеми связанными данными читаются одним запросом"""
+        buyer = user_factory(role='buyer')
+        order = order_factory(customer=buyer, status='accepted')
+        seller = order.items.first().seller
+        seller.role = 'seller'
+        seller.save()
+        user = buyer if user_role == 'buyer' else seller
+        url = reverse('orders-detail', kwargs={'pk': order.pk})
+        api_client.force_authenticate(user)
+        with django_assert_max_num_queries(3):
+            response = api_client.get(url)
+        assert response.status_code == 200
+        assert len(response.json()['items']) == (5 if user_role == 'buyer' else 1)
     
-        
\ No newline at end of file
+    def test_order_retrieve_other_seller(self, api_client, user_factory, order_factory,
+                                         django_assert_num_queries):
+        """Продавец без позиций в заказе не видит заказ"""
+        order = order_factory(customer=user_factory(role='buyer'), status='accepted')
+        seller = user_factory(role='seller')
+        api_client.force_authenticate(seller)
+        response = api_client.get(reverse('orders-detail', kwargs={'pk': order.pk}))
+        assert response.status_code == 404
+        # Проверка позиций продавца запоминается на время запроса
+        request = Request(APIRequestFactory().get('/'))
+        request.user = seller
+        with django_assert_num_queries(1):
+            assert not OrderPermission.is_order_seller(request, order)
+            assert not OrderPermission.is_order_seller(request, order)
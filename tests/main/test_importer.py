@@ -0,0 +1,347 @@
+import gzip
+import io
+import json
+
+import pytest
+from django.db import transaction
+from model_bakery import baker
+
+from main import importer
+from main.models import Order, OrderItem, Pricelist, PricelistFile, Product, Variant
+from main.offers import reserve_stock
+from main.tasks import finish_pricelist_import, parse_pricelist, pricelist_import_failed
+
+# Счётчики изменений в результате импорта
+IMPORT_COUNTS = ['inserted', 'updated', 'unchanged', 'removed']
+CSV_HEADER = 'Категория,Бренд,Модель,Артикул,Количество,Цена,Цена доставки\n'
+
+
+def csv_content(*rows):
+    return (CSV_HEADER + ''.join(f'{row}\n' for row in rows)).encode()
+
+
+@pytest.mark.django_db
+class TestImporter:
+    def test_too_long_values(self, user_factory, pricelist_file_factory):
+        """Значения длиннее полей модели отклоняются проверкой, в базу ничего не пишется"""
+        seller = user_factory(role='seller')
+        file = pricelist_file_factory(seller, csv_content(
+            'phones,acme,a1,sku-1,1,100,10',
+            f'phones,acme,a1,{"x" * 60},1,100,10',
+            f'phones,acme,a1,sku-3,1,100,10,{"t" * 256},value',
+        ))
+        parse_pricelist(file.id)
+        file.refresh_from_db()
+        assert [error['line'] for error in file.upload_result['errors']] == [2, 3]
+        assert not Pricelist.objects.exists()
+        assert not file.file
+    
+    @pytest.mark.parametrize('jsonl', [False, True])
+    def test_not_utf8_lines(self, user_factory, pricelist_file_factory, jsonl):
+        """Строки не в UTF-8 (cp1251) попадают в список ошибок с номерами строк"""
+        if jsonl:
+            rows = [json.dumps({
+                'category': 'телефоны', 'brand': 'acme', 'model': f'a{ix}', 'sku': f'sku-{ix}',
+                'in_stock': 1, 'product_price': 100, 'delivery_price': 10
+            }, ensure_ascii=False) for ix in range(3)]
+            content = b'\n'.join([
+                rows[0].encode(), rows[1].encode('cp1251'), rows[2].encode()])
+        else:
+            content = csv_content('телефоны,acme,a0,sku-0,1,100,10') + \
+                'телефоны,acme,a1,sku-1,1,100,10\n'.encode('cp1251') + \
+                'телефоны,acme,a2,sku-2,1,100,10\n'.encode()
+        file = pricelist_file_factory(user_factory(role='seller'), content)
+        parse_pricelist(file.id)
+        file.refresh_from_db()
+        assert file.upload_result['errors'] == [
+            {'line': 2, 'detail': 'line is not valid UTF-8 text'}]
+        assert not Variant.objects.exists()
+    
+    @pytest.mark.parametrize('import_mode', ['chunk', 'file'])
+    def test_remove_missing(self, user_factory, pricelist_file_factory, import_mode):
+        """Позиции, не отмеченные новой выгрузкой (в том числе неизменившиеся), остаются"""
+        seller = user_factory(role='seller')
+        rows = ['phones,acme,a1,sku-1,5,100,10', 'phones,acme,a2,sku-2,5,200,10']
+        parse_pricelist(pricelist_file_factory(seller, csv_content(*rows)).id)
+        file = pricelist_file_factory(seller, csv_content(rows[0]), import_mode=import_mode)
+        parse_pricelist(file.id)
+        file.refresh_from_db()
+        assert file.upload_result['unchanged'] == 1
+        assert file.upload_result['removed'] == 1
+        assert dict(Pricelist.objects.values_list('variant__sku', 'in_stock')) == {
+            'sku-1': 5, 'sku-2': 0}
+        assert Pricelist.objects.get(variant__sku='sku-1').import_id == file.id
+    
+    def test_import_failure_status(self, user_factory, pricelist_file_factory, monkeypatch):
+        """Непредвиденная ошибка импорта записывает итоговый статус `failed`"""
+        def import_chunk(self, lines):
+            raise RuntimeError('database is gone')
+        
+        monkeypatch.setattr('main.importer.PricelistImporter.import_chunk', import_chunk)
+        seller = user_factory(role='seller')
+        file = pricelist_file_factory(
+            seller, csv_content('phones,acme,a1,sku-1,1,100,10'), import_mode='file')
+        with pytest.raises(RuntimeError):
+            parse_pricelist(file.id)
+        file = PricelistFile.objects.get(pk=file.id)
+        assert file.upload_result == {'status': 'failed', 'error': 'Import failed (RuntimeError)'}
+        assert not file.file
+        assert not Variant.objects.exists()
+        # В режиме chunk ошибка диапазона попадает в список ошибок результата
+        file = pricelist_file_factory(seller, csv_content('phones,acme,a1,sku-1,1,100,10'))
+        parse_pricelist(file.id)
+        file.refresh_from_db()
+        assert file.upload_result['status'] == 'failed'
+        assert file.upload_result['errors'] == [
+            {'rows': [0, 1], 'detail': 'Import failed (RuntimeError)'}]
+    
+    @pytest.mark.parametrize('compress', [False, True])
+    @pytest.mark.parametrize('file_format', ['csv', 'jsonl', 'parquet'])
+    def test_read_from_shard_start(self, user_factory, pricelist_file_factory, monkeypatch,
+                                   file_format, compress):
+        """Диапазон читается с позиции из проверки файла так же, как с начала файла"""
+        monkeypatch.setattr(importer, 'SHARD_SIZE', 3)
+        rows = [f'phones,acme,"a, {ix}",sku-{ix},1,{ix},10' for ix in range(8)]
+        if file_format == 'csv':
+            content = csv_content(*rows[:4], '', *rows[4:])
+        elif file_format == 'parquet':
+            if compress:
+                pytest.skip('Parquet сжимается внутри файла')
+            pa = pytest.importorskip('pyarrow')
+            pq = pytest.importorskip('pyarrow.parquet')
+            monkeypatch.setattr(importer, 'CHUNK_SIZE', 2)
+            content = io.BytesIO()
+            pq.write_table(pa.table({
+                'category': ['phones'] * 8, 'brand': ['acme'] * 8,
+                'model': [f'a, {ix}' for ix in range(8)], 'sku': [f'sku-{ix}' for ix in range(8)],
+                'in_stock': [1] * 8, 'product_price': list(range(8)), 'delivery_price': [10] * 8
+            }), content)
+            content = content.getvalue()
+        else:
+            content = '\n'.join(json.dumps({
+                'category': 'phones', 'brand': 'acme', 'model': f'a, {ix}', 'sku': f'sku-{ix}',
+                'in_stock': 1, 'product_price': ix, 'delivery_price': 10
+            }) for ix in range(8)).encode()
+        if compress:
+            content = gzip.compress(content)
+        file = pricelist_file_factory(user_factory(role='seller'), content)
+        validation = importer.validate_pricelist(file.file)
+        assert validation.rows_total == 8
+        for (start, stop), resume in zip(importer.split_shards(8, 3), validation.shard_starts):
+            expected = list(importer.read_pricelist(file.file, start=start, stop=stop))
+            assert list(importer.read_pricelist(
+                file.file, start=start, stop=stop, resume=resume)) == expected
+    
+    def test_shard_errors(self, user_factory, pricelist_file_factory):
+        """Ошибки диапазонов объединяются, позиции при этом с продажи не снимаются"""
+        seller = user_factory(role='seller')
+        file = pricelist_file_factory(seller, csv_content('phones,acme,a1,sku-1,1,100,10'))
+        error = {'rows': [0, 20000], 'detail': 'Import failed (DataError)'}
+        finish_pricelist_import([
+            {'inserted': 10, 'updated': 0, 'unchanged': 0, 'removed': 0},
+            {'inserted': 5, 'updated': 0, 'unchanged': 0, 'removed': 0, 'error': error},
+        ], file.id)
+        file.refresh_from_db()
+        assert file.upload_result['status'] == 'failed'
+        assert file.upload_result['errors'] == [error]
+        assert file.upload_result['inserted'] == 15
+        assert not file.file
+        
+        file = pricelist_file_factory(seller, csv_content('phones,acme,a1,sku-1,1,100,10'))
+        pricelist_import_failed(None, RuntimeError(), None, file.id)
+        file.refresh_from_db()
+        assert file.upload_result['status'] == 'failed'
+    
+    @pytest.mark.parametrize('import_mode', ['chunk', 'file'])
+    def test_reupload_counts(self, user_factory, pricelist_file_factory, import_mode):
+        """Счётчики новых, изменённых, неизменившихся и снятых с продажи строк"""
+        seller = user_factory(role='seller')
+        file = pricelist_file_factory(seller, csv_content(
+            'Phones,Acme,A1,sku-1,5,100,10,Цвет,Чёрный',
+            'phones,acme,a1,sku-2,5,200,10',
+            'phones,acme,a2,sku-3,5,300,10',
+        ), import_mode=import_mode)
+        parse_pricelist(file.id)
+        file.refresh_from_db()
+        assert file.upload_result['status'] == 'parsed successfully'
+        assert {key: file.upload_result[key] for key in IMPORT_COUNTS} == {
+            'inserted': 3, 'updated': 0, 'unchanged': 0, 'removed': 0}
+        assert Product.objects.count() == 2
+        assert list(Variant.objects.get(sku='sku-1').props.values_list('title', 'value')) == [
+            ('цвет', 'чёрный')]
+        
+        file = pricelist_file_factory(seller, csv_content(
+            'phones,acme,a1,sku-1,5,100,10,цвет,чёрный',
+            'phones,acme,a1,sku-2,7,250,10',
+            'phones,acme,a3,sku-4,1,400,10',
+        ), import_mode=import_mode)
+        parse_pricelist(file.id)
+        file.refresh_from_db()
+        assert {key: file.upload_result[key] for key in IMPORT_COUNTS} == {
+            'inserted': 1, 'updated': 1, 'unchanged': 1, 'removed': 1}
+        # Справочники второй выгрузки найдены в предзагруженном кэше
+        assert file.upload_result['cache_hits'] > 0
+        assert dict(Pricelist.objects.values_list('variant__sku', 'product_price')) == {
+            'sku-1': 100, 'sku-2': 250, 'sku-3': 300, 'sku-4': 400}
+        assert Pricelist.objects.get(variant__sku='sku-3').in_stock == 0
+        assert not file.file
+    
+    @pytest.mark.parametrize('name, compress', [
+        ('pricelist.csv.gz', True),
+        ('pricelist.jsonl', False),
+        ('pricelist.jsonl.gz', True),
+    ])
+    def test_import_formats(self, user_factory, pricelist_file_factory, name, compress):
+        """Сжатый gzip CSV и JSON Lines импортируются так же, как CSV"""
+        rows = [
+            ['phones', 'acme', 'a, 1', 'sku-1', 5, 100, 10, 'цвет', 'чёрный'],
+            ['phones', 'acme', 'a2', 'sku-2', 3, 200, 20],
+        ]
+        if name.startswith('pricelist.csv'):
+            content = csv_content(
+                'phones,acme,"a, 1",sku-1,5,100,10,цвет,чёрный', 'phones,acme,a2,sku-2,3,200,20')
+        else:
+            content = '\n'.join(json.dumps({
+                **dict(zip(importer.ROW_FIELDS, row[:7])),
+                'props': {row[7]: row[8]} if len(row) > 7 else {}
+            }, ensure_ascii=False) for row in rows).encode()
+        if compress:
+            content = gzip.compress(content)
+        seller = user_factory(role='seller')
+        file = pricelist_file_factory(seller, content, name=name)
+        parse_pricelist(file.id)
+        file.refresh_from_db()
+        assert file.upload_result['status'] == 'parsed successfully'
+        assert file.upload_result['inserted'] == 2
+        assert sorted(Pricelist.objects.values_list(
+            'variant__product__title', 'variant__sku', 'in_stock', 'product_price',
+            'delivery_price')) == [('a, 1', 'sku-1', 5, 100, 10), ('a2', 'sku-2', 3, 200, 20)]
+        assert list(Variant.objects.get(sku='sku-1').props.values_list('title', 'value')) == [
+            ('цвет', 'чёрный')]
+    
+    def test_validation_errors(self, user_factory, pricelist_file_factory, monkeypatch):
+        """В результат попадают все ошибки файла, включая повторы артикулов"""
+        seller = user_factory(role='seller')
+        content = csv_content(
+            'phones,acme,a1,sku-1,1,100,10',
+            'phones,acme,a1,sku-2,many,100,10',
+            'phones,acme,a1,sku-1,1,100,10',
+            'phones,acme,a1,sku-3,1,100',
+            'phones,acme,a1,sku-1,1,100,10',
+        )
+        file = pricelist_file_factory(seller, content)
+        parse_pricelist(file.id)
+        file.refresh_from_db()
+        first_line = file.upload_result['errors'][0]['line'] - 1
+        assert file.upload_result['errors'] == [
+            {
+                'line': first_line + 1,
+                'value': 'many',
+                'detail': 'Field `in_stock` (index 4) must be of type <class \'int\'>'
+            },
+            {
+                'line': first_line + 2,
+                'value': 'sku-1',
+                'detail': f'Duplicate product sku (first occurrence on line {first_line})'
+            },
+            {
+                'line': first_line + 3,
+                'detail': 'wrong column count (not enough `characteristic-value` pairs)'
+            },
+            {
+                'line': first_line + 4,
+                'value': 'sku-1',
+                'detail': f'Duplicate product sku (first occurrence on line {first_line})'
+            },
+        ]
+        assert file.upload_result['errors_total'] == 4
+        assert not Variant.objects.exists()
+        assert not file.file
+        
+        # Список ошибок ограничен MAX_ERRORS, общее количество сохраняется
+        monkeypatch.setattr(importer, 'MAX_ERRORS', 2)
+        file = pricelist_file_factory(seller, content)
+        parse_pricelist(file.id)
+        file.refresh_from_db()
+        assert [error['line'] for error in file.upload_result['errors']] == [
+            first_line + 1, first_line + 2]
+        assert file.upload_result['errors_total'] == 4
+    
+    @pytest.mark.parametrize('import_mode', ['chunk', 'file'])
+    def test_import_mode_rollback(self, user_factory, pricelist_file_factory, monkeypatch,
+                                  import_mode):
+        """
+        В режиме `file` ошибка откатывает весь файл, в режиме `chunk` -
+        только порции после уже записанных
+        """
+        import_chunk = importer.PricelistImporter.import_chunk
+        
+        def failing_import_chunk(self, lines):
+            # Первая порция записывается, на второй импорт обрывается
+            import_chunk(self, lines[:2])
+            raise RuntimeError('database is gone')
+        
+        monkeypatch.setattr(importer.PricelistImporter, 'import_chunk', failing_import_chunk)
+        seller = user_factory(role='seller')
+        file = pricelist_file_factory(seller, csv_content(
+            *(f'phones,acme,a1,sku-{ix},1,100,10' for ix in range(4))
+        ), import_mode=import_mode)
+        if import_mode == 'file':
+            with pytest.raises(RuntimeError):
+                parse_pricelist(file.id)
+            assert not Pricelist.objects.exists()
+        else:
+            parse_pricelist(file.id)
+            assert sorted(Pricelist.objects.values_list('variant__sku', flat=True)) == [
+                'sku-0', 'sku-1']
+        file = PricelistFile.objects.get(pk=file.id)
+        assert file.upload_result['status'] == 'failed'
+    
+    @pytest.mark.parametrize('replace_props, expected', [
+        (False, [('память', '128'), ('цвет', 'белый'), ('цвет', 'чёрный')]),
+        (True, [('память', '128'), ('цвет', 'белый')]),
+    ])
+    def test_replace_props(self, user_factory, pricelist_file_factory, replace_props, expected):
+        """Характеристики из прайс-листа дополняют или заменяют набор модификации"""
+        seller = user_factory(role='seller')
+        parse_pricelist(pricelist_file_factory(seller, csv_content(
+            'phones,acme,a1,sku-1,1,100,10,цвет,чёрный,память,128')).id)
+        file = pricelist_file_factory(seller, csv_content(
+            'phones,acme,a1,sku-1,1,100,10,цвет,белый,память,128'
+        ), replace_props=replace_props)
+        parse_pricelist(file.id)
+        file.refresh_from_db()
+        assert file.upload_result['updated'] == 1
+        assert sorted(Variant.objects.get(sku='sku-1').props.values_list(
+            'title', 'value')) == expected
+    
+    def test_reupload_after_checkout(self, user_factory, pricelist_file_factory):
+        """Повторная выгрузка восстанавливает остаток, списанный заказом"""
+        seller = user_factory(role='seller')
+        content = csv_content('phones,acme,a1,sku-1,10,100,10')
+        parse_pricelist(pricelist_file_factory(seller, content).id)
+        pricelist = Pricelist.objects.get()
+        order = baker.make(Order, status='in_cart')
+        OrderItem.objects.create(order=order, pricelist=pricelist, quantity=3)
+        with transaction.atomic():
+            reserve_stock(order.id)
+        pricelist.refresh_from_db()
+        assert pricelist.in_stock == 7
+        
+        file = pricelist_file_factory(seller, content)
+        parse_pricelist(file.id)
+        file.refresh_from_db()
+        assert file.upload_result['updated'] == 1
+        assert file.upload_result['unchanged'] == 0
+        pricelist.refresh_from_db()
+        assert pricelist.in_stock == 10
+        
+        # Позиция, которой нет в выгрузке, снимается с продажи и после списания
+        with transaction.atomic():
+            reserve_stock(order.id)
+        file = pricelist_file_factory(seller, csv_content('phones,acme,a1,sku-2,1,100,10'))
+        parse_pricelist(file.id)
+        file.refresh_from_db()
+        assert file.upload_result['removed'] == 1
+        pricelist.refresh_from_db()
+        assert pricelist.in_stock == 0
@@ -13,6 +13,8 @@ class User(AbstractBaseUser):
     email = models.EmailField('Адрес', max_length=255, unique=True)
     company = models.CharField('Компания', max_length=255)
     role = models.CharField('Должность', choices=ROLES, max_length=6)
+    # Доступ к служебным ресурсам (статистика кэша, удаление заказов)
+    is_admin = models.BooleanField('Администратор', default=False)
 
     USERNAME_FIELD = 'email'
 
@@ -1,6 +1,6 @@
 from rest_framework.permissions import BasePermission
 
-from main.models import Order
+from main.models import OrderItem
 
 
 class IsSeller(BasePermission):
@@ -13,6 +13,11 @@ class IsBuyer(BasePermission):
         return bool(request.user and request.user.role == 'buyer')
 
 
+class IsAdmin(BasePermission):
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_authenticated and request.user.is_admin)
+
+
 class OrderPermission(BasePermission):
     def has_permission(self, request, view):
         is_auth = request.user.is_authenticated
@@ -32,15 +37,29 @@ class OrderPermission(BasePermission):
         if not is_auth:
             return False
         
-        is_seller = bool(request.user.role == 'seller')
-        seller_orders = Order.objects.filter(items__seller=request.user) if is_seller else None
-        
         if view.action == 'retrieve':
-            return obj.customer == request.user or is_seller and obj in seller_orders
-        elif view.action in ['update', 'partial_update'] and is_seller and obj in seller_orders:
+            return obj.customer_id == request.user.id or self.is_order_seller(request, obj)
+        elif view.action in ['update', 'partial_update'] and self.is_order_seller(request, obj):
             return True
         elif view.action == 'destroy':
             # Может-ли кто-то вообще удалять заказы?
             return request.user.is_admin
         else:
             return False
+
+    @staticmethod
+    def is_order_seller(request, order):
+        """
+        Есть ли в заказе позиции продавца - один EXISTS по позициям заказа
+        (индекс по order_id), результат запоминается на время запроса.
+        """
+        if request.user.role != 'seller':
+            return False
+        checked = getattr(request, '_checked_seller_orders', None)
+        if checked is None:
+            checked = {}
+            setattr(request, '_checked_seller_orders', checked)
+        if order.pk not in checked:
+            checked[order.pk] = OrderItem.objects.filter(
+                order_id=order.pk, pricelist__seller=request.user).exists()
+        return checked[order.pk]